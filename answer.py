@@ -1,9 +1,11 @@
 """RAG answering script using ChromaDB retrieval and an Ollama-served LLM.
 
 Pipeline:
-- Embed the user query with the same embedder used during ingestion.
+- Embed the user query with the same embedder used during ingestion (cached
+  on disk, see `embed_cache.py`).
 - Retrieve top-k similar chunks from the `docs` collection in ChromaDB.
-- Build a grounded prompt that includes citations for each supporting chunk.
+- Build a grounded prompt that includes citations for each supporting chunk,
+  packing chunks into a token budget (see `context_packer.py`).
 - Generate an answer via Ollama's `/api/generate`, optionally streaming tokens.
 
 Environment variables:
@@ -19,10 +21,13 @@ Environment variables:
 - `STREAM_OUTPUT` (default: `true`) — stream generation output if true
 """
 
-import os, sys, json, requests, textwrap
+import os, sys, json, textwrap
 from dotenv import load_dotenv
 import chromadb
 from chromadb.utils import embedding_functions
+from embeddings import embed_query
+import ollama_client
+from context_packer import pack_context, render_context, estimate_tokens
 
 # Load config
 load_dotenv()
@@ -52,7 +57,7 @@ def retrieve(query):
     Returns a list of tuples: (document_text, metadata, similarity_score).
     """
     res = collection.query(
-        query_texts=[query],
+        query_embeddings=[embed_query(query)],  # cached query embedding
         n_results=TOP_K,
         include=["documents", "metadatas", "distances"]
     )
@@ -62,32 +67,32 @@ def retrieve(query):
     scores = [1 - d for d in dists]
     return list(zip(docs, metas, scores))
 
-def build_prompt(query, hits):
+def build_prompt(query, hits, stats=None):
     """Construct a grounded prompt with inline citations.
 
     - Filters hits below `MIN_SCORE`; if none remain, keeps the top 2 as a
       minimal context.
-    - Assembles labeled context blocks and a citation note for the instructions.
-    - Truncates overly long context to keep prompts manageable.
+    - Packs labeled context blocks, best score first, into the
+      `CONTEXT_TOKENS` budget, trimming or dropping the lowest-value chunks
+      at sentence boundaries (see `context_packer.pack_context`).
+    - Assembles a citation note for the instructions from the kept blocks.
     - Wraps sections in simple tags (<SYSTEM>, <USER>) for clarity.
+    - If a `stats` dict is passed, fills it with the packing counts and the
+      estimated `prompt_tokens`.
     """
     relevant = [h for h in hits if h[2] >= MIN_SCORE]
     if not relevant:
         relevant = hits[:2]
 
-    context_blocks, citations = [], []
-    for i, (chunk, meta, score) in enumerate(relevant, 1):
+    blocks = []
+    for chunk, meta, score in sorted(relevant, key=lambda h: h[2], reverse=True):
         src = meta.get("source_file", "?")
         page = meta.get("page_number", "?")
-        label = f"{src} p.{page}"
-        context_blocks.append(f"[{i}] {label}\n{chunk}")
-        citations.append(label)
+        blocks.append((f"{src} p.{page}", chunk))
 
-    context = "\n\n".join(context_blocks)
-    if len(context) > 8000:
-        context = context[:8000] + "\n… [truncated]"
-
-    cite_note = ", ".join(citations)
+    kept, pack_stats = pack_context(blocks)
+    context = render_context(kept)
+    cite_note = ", ".join(label for label, _ in kept)
 
     system = textwrap.dedent(f"""
     You are an expert assistant. Answer the user's question using only the CONTEXT provided.
@@ -108,17 +113,21 @@ def build_prompt(query, hits):
     - Use content verbatim if appropriate.
     """).strip()
 
-    return f"<SYSTEM>\n{system}\n</SYSTEM>\n<USER>\n{user}\n</USER>"
+    prompt = f"<SYSTEM>\n{system}\n</SYSTEM>\n<USER>\n{user}\n</USER>"
+    if stats is not None:
+        stats.update(pack_stats, prompt_tokens=estimate_tokens(prompt))
+    return prompt
 
 def generate(prompt):
     """Synchronous generation via Ollama `/api/generate`.
 
     Returns the final response string (non-streaming).
-    Raises for HTTP errors and applies a request timeout.
+    Raises for HTTP errors and applies a request timeout. Uses the pooled
+    session from `ollama_client`.
     """
-    r = requests.post(
+    r = ollama_client.post(
         f"{OLLAMA_URL}/api/generate",
-        json={
+        {
             "model": LLM_MODEL,
             "prompt": prompt,
             "options": {
@@ -129,7 +138,6 @@ def generate(prompt):
         },
         timeout=ANSWER_TIMEOUT
     )
-    r.raise_for_status()
     return r.json().get("response", "").strip()
 
 def generate_stream(prompt):
@@ -145,7 +153,7 @@ def generate_stream(prompt):
         "options": {"temperature": TEMPERATURE, "num_predict": NUM_PREDICT},
         "stream": True
     }
-    with requests.post(url, json=payload, stream=True) as r:
+    with ollama_client.post(url, payload, timeout=ANSWER_TIMEOUT, stream=True) as r:
         for line in r.iter_lines():
             if line:
                 data = json.loads(line.decode("utf-8"))
@@ -168,7 +176,13 @@ def main():
     if best_score < MIN_SCORE:
         print("⚠️ Low confidence retrieval — answer may be uncertain.\n")
 
-    prompt = build_prompt(query, hits)
+    prompt_stats = {}
+    prompt = build_prompt(query, hits, prompt_stats)
+    print(
+        f"Prompt: ~{prompt_stats['prompt_tokens']} tokens "
+        f"({prompt_stats['chunks_used']} chunks, {prompt_stats['chunks_trimmed']} trimmed, "
+        f"{prompt_stats['chunks_dropped']} dropped)"
+    )
 
     print("\n=== ANSWER ===\n")
     if STREAM_OUTPUT:
@@ -0,0 +1,157 @@
+"""In-memory answer cache for the `/ask` endpoint.
+
+Users ask the same policy questions over and over; a cached answer skips
+retrieval and LLM generation entirely. Entries are keyed on the normalized
+question plus the generation parameters that shape the answer:
+
+- Exact hit: the normalized question (case, whitespace and trailing
+  punctuation folded) was answered before.
+- Semantic hit (optional): the question's embedding has cosine similarity of
+  at least `ANSWER_CACHE_SIM` with a cached question's embedding.
+
+Entries expire after `ANSWER_CACHE_TTL` seconds and the least recently used
+are evicted past `ANSWER_CACHE_SIZE`. The whole cache is dropped when the
+indexed corpus changes, detected from the BM25 manifest pointer and the
+ingest manifest (both rewritten by every ingest/index build).
+
+Environment variables:
+- `ANSWER_CACHE`          (default: `true`) — enable the cache
+- `ANSWER_CACHE_SIZE`     (default: `1000`) — max cached answers (LRU)
+- `ANSWER_CACHE_TTL`      (default: `3600`) — seconds before an answer expires
+- `ANSWER_CACHE_SEMANTIC` (default: `false`) — also match similar questions
+- `ANSWER_CACHE_SIM`      (default: `0.95`) — cosine threshold for semantic hits
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SEMANTIC = os.getenv("ANSWER_CACHE_SEMANTIC", "false").lower() == "true"
+ANSWER_CACHE_SIM = float(os.getenv("ANSWER_CACHE_SIM", "0.95"))
+# Files rewritten whenever the indexed corpus changes
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./data/bm25_index")
+INGEST_MANIFEST = os.getenv("INGEST_MANIFEST", "./data/ingest_manifest.json")
+
+def normalize_query(query: str) -> str:
+    """Fold case, whitespace and trailing punctuation so trivial variants share a key."""
+    return re.sub(r"[\s?.!]+$", "", " ".join(query.lower().split()))
+
+def index_generation():
+    """Token that changes whenever the BM25 index or the ingested corpus changes."""
+    token = []
+    for path in (os.path.join(BM25_INDEX_PATH, "CURRENT"), INGEST_MANIFEST):
+        try:
+            st = os.stat(path)
+            token.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        except OSError:
+            token.append(None)
+    return tuple(token)
+
+class AnswerCache:
+    """TTL + LRU map from (normalized question, params) to a cached answer.
+
+    Values are opaque dicts (answer, matches, timing). Thread-safe; lookups
+    first compare the index generation and clear everything if it moved.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl_s: float = ANSWER_CACHE_TTL,
+                 semantic: bool = ANSWER_CACHE_SEMANTIC, threshold: float = ANSWER_CACHE_SIM):
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self.semantic = semantic
+        self.threshold = threshold
+        self._entries = OrderedDict()  # key -> (created, value, unit vector or None)
+        self._lock = threading.Lock()
+        self._generation = index_generation()
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+    def _check_generation(self):
+        generation = index_generation()
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def _expired(self, created):
+        return time.time() - created > self.ttl_s
+
+    def lookup(self, query: str, params, embedding=None):
+        """Return (value, "exact" | "semantic") for a cached answer, or (None, None).
+
+        `embedding` (the query vector) is only needed for semantic hits.
+        """
+        key = (normalize_query(query), params)
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits["exact"] += 1
+                return entry[1], "exact"
+
+            if self.semantic and embedding is not None:
+                best_key, best_sim = self._nearest(params, _unit(embedding))
+                if best_key is not None and best_sim >= self.threshold:
+                    self._entries.move_to_end(best_key)
+                    self.hits["semantic"] += 1
+                    return self._entries[best_key][1], "semantic"
+
+            self.misses += 1
+            return None, None
+
+    def _nearest(self, params, vec):
+        """Most similar live cached question with the same params (linear scan)."""
+        keys, vecs = [], []
+        for key, (created, _, cached) in list(self._entries.items()):
+            if self._expired(created):
+                del self._entries[key]
+            elif key[1] == params and cached is not None:
+                keys.append(key)
+                vecs.append(cached)
+        if not keys:
+            return None, 0.0
+        sims = np.stack(vecs) @ vec
+        best = int(np.argmax(sims))
+        return keys[best], float(sims[best])
+
+    def store(self, query: str, params, value, embedding=None):
+        """Cache `value` for the question, evicting the least recently used past the bound."""
+        key = (normalize_query(query), params)
+        vec = _unit(embedding) if self.semantic and embedding is not None else None
+        with self._lock:
+            self._check_generation()
+            self._entries[key] = (time.time(), value, vec)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+def _unit(vec):
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_answer_cache():
+    """Return the process-wide answer cache, or None when `ANSWER_CACHE` is disabled."""
+    global _CACHE
+    if not ANSWER_CACHE:
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = AnswerCache()
+    return _CACHE
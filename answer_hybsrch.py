@@ -1,18 +1,36 @@
 """Hybrid search RAG: dense vectors (Chroma) + BM25 fallback.
 
 Flow:
-- Retrieve top-k results from ChromaDB (vector similarity) and from BM25 index.
-- Merge and deduplicate by (source_file, page_number), sort by score.
-- Build a grounded prompt with inline citations and source tags.
+- Retrieve top-k results from ChromaDB (vector similarity) and from BM25 index,
+  running both legs concurrently with per-leg timeouts.
+- Fuse the two ranked lists onto a common scale (see `fusion.py`), then
+  deduplicate by (source_file, page_number).
+- Build a grounded prompt with inline citations and source tags, packing
+  chunks into a token budget (see `context_packer.py`).
 - Generate an answer via Ollama, with optional streaming and basic timing.
 
+`aretrieve`, `agenerate` and `astream_generate` are async twins of the
+retrieval/generation steps for event-loop callers such as the FastAPI app.
+
+Each retrieval stage (embedding, vector search, BM25, fusion, prompt build)
+records its latency in `metrics.py` and, inside a request trace, a span in
+`tracing.py` (`retrieve`, `vector_search`/`embed`, `query_bm25`, `fusion`,
+`build_prompt`, `generate`).
+
 Environment variables control paths, models, and thresholds (see Config).
 """
 
-import os, sys, json, time, requests, textwrap
+import os, sys, json, time, textwrap, threading, asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from dotenv import load_dotenv
 import chromadb
 from chromadb.utils import embedding_functions
+import fusion
+from embeddings import embed_query, embed_texts
+import ollama_client
+import metrics
+import tracing
+from context_packer import pack_context, render_context, estimate_tokens
 
 # ------------------------------------
 # Config
@@ -29,6 +47,10 @@ TEMPERATURE     = float(os.getenv("TEMPERATURE", "0.2"))
 MIN_SCORE       = float(os.getenv("MIN_SCORE", "0.25"))
 ANSWER_TIMEOUT  = int(os.getenv("ANSWER_TIMEOUT", "600"))
 STREAM_OUTPUT   = os.getenv("STREAM_OUTPUT", "true").lower() == "true"
+# Per-leg retrieval deadlines (seconds); a leg that misses it is dropped
+VECTOR_TIMEOUT  = float(os.getenv("VECTOR_TIMEOUT", "30"))
+BM25_TIMEOUT    = float(os.getenv("BM25_TIMEOUT", "5"))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
 
 # ------------------------------------
 # Helpers
@@ -41,60 +63,253 @@ def approx_tokens_to_words(tokens: int) -> int:
     return int(tokens * 0.5)
 
 # ------------------------------------
-# Retrieval
+# Shared retrieval context
 # ------------------------------------
-def retrieve(query: str, top_k: int = TOP_K):
-    """Hybrid retrieval: dense (Chroma) + lexical (BM25).
+class RetrievalContext:
+    """Chroma client, Ollama embedder and `docs` collection, opened once.
 
-    - Queries Chroma for vector-similar chunks and converts cosine distance to
-      similarity via `1.0 - distance`.
-    - Queries BM25 index if available and tags results with their source.
-    - Deduplicates on (source_file, page_number) to avoid repeated context.
-    - Returns top_k merged results plus retrieval latency in seconds.
+    Opening the persistent client reloads the SQLite/HNSW store, so the
+    context is created lazily on first use and then shared by every request
+    in the process (FastAPI workers, Gradio callbacks, CLI).
+    """
+
+    def __init__(self):
+        self.client = chromadb.PersistentClient(path=CHROMA_DIR)
+        self.embedder = embedding_functions.OllamaEmbeddingFunction(model_name=EMBED_MODEL, url=OLLAMA_URL)
+        self.collection = self.client.get_or_create_collection("docs", embedding_function=self.embedder)
+
+_CONTEXT = None
+_CONTEXT_LOCK = threading.Lock()
+
+def get_context():
+    """Return the process-wide `RetrievalContext`, creating it on first call (thread-safe)."""
+    global _CONTEXT
+    if _CONTEXT is None:
+        with _CONTEXT_LOCK:
+            if _CONTEXT is None:
+                _CONTEXT = RetrievalContext()
+    return _CONTEXT
+
+def warmup():
+    """Open the retrieval context and BM25 index ahead of the first request.
+
+    Also sends a tiny embedding request so Ollama loads the embed model now
+    rather than during the first user query. Failures are reported but not
+    raised; the first real request will retry.
     """
     t0 = time.perf_counter()
-    client = chromadb.PersistentClient(path=CHROMA_DIR)
-    embedder = embedding_functions.OllamaEmbeddingFunction(model_name=EMBED_MODEL, url=OLLAMA_URL)
-    col = client.get_or_create_collection("docs", embedding_function=embedder)
-    res = col.query(query_texts=[query], n_results=top_k, include=["documents", "metadatas", "distances"])
-    vector_hits = [
+    try:
+        get_context()
+    except Exception as e:
+        print(f"[warn] Chroma warm-up failed: {e}")
+    try:
+        from bm25_query import load_index
+        load_index()
+    except Exception as e:
+        print(f"[warn] BM25 warm-up failed: {e}")
+    try:
+        embed_texts(["warmup"], use_cache=False)  # bypass the cache so the model actually loads
+    except Exception as e:
+        print(f"[warn] Embedding warm-up failed: {e}")
+    print(f"[✓] Retrieval warm-up done in {time.perf_counter() - t0:.2f}s")
+
+# ------------------------------------
+# Retrieval
+# ------------------------------------
+# One pool per leg so the vector and BM25 legs of a query run side by side,
+# and a hung leg (e.g. a BM25 index load waiting on the writer lock) only
+# ties up its own threads instead of starving the other leg
+_VECTOR_POOL = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieve-vector")
+_BM25_POOL = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieve-bm25")
+
+def vector_search(query: str, top_k: int):
+    """Dense leg: query Chroma and tag hits as (text, meta, similarity, "vector").
+
+    The query vector comes from the persistent embedding cache when the same
+    question was asked before, skipping the Ollama round trip.
+    """
+    with tracing.span("vector_search", top_k=top_k) as sp:
+        col = get_context().collection
+        with tracing.span("embed"), metrics.EMBED_SECONDS.time():
+            query_vec = embed_query(query)
+        with metrics.VECTOR_SEARCH_SECONDS.time():
+            res = col.query(
+                query_embeddings=[query_vec], n_results=top_k,
+                include=["documents", "metadatas", "distances"],
+            )
+        sp.set(hits=len(res["ids"][0]))
+    return [
         (doc, meta, 1.0 - dist, "vector")    # mark vector source
         for doc, meta, dist in zip(res["documents"][0], res["metadatas"][0], res["distances"][0])
     ]
 
-    # BM25 fallback
+def bm25_search(query: str, top_k: int):
+    """Lexical leg: query the BM25 index and tag hits as (text, meta, score, "bm25")."""
+    from bm25_query import query_bm25
+    with metrics.BM25_SECONDS.time():
+        hits = query_bm25(query, top_k=top_k)
+    return [(doc, meta, score, "bm25") for doc, meta, score in hits]
+
+def _leg_result(future, deadline, name, hint=None):
+    """Wait for a retrieval leg until `deadline`; on timeout or error, drop it.
+
+    A timed-out leg is cancelled if it is still queued; one already running
+    keeps its thread in the leg's pool but its result is ignored, so a slow
+    leg never stalls the answer beyond its own deadline.
+    """
     try:
-        from bm25_query import query_bm25
-        bm25_hits_raw = query_bm25(query, top_k=top_k)
-        bm25_hits = [(doc, meta, score, "bm25") for doc, meta, score in bm25_hits_raw]  # mark BM25 source
+        return future.result(timeout=max(0.0, deadline - time.perf_counter()))
+    except FutureTimeout:
+        future.cancel()
+        metrics.ERRORS.inc(stage=f"{name.lower()}_timeout")
+        print(f"[warn] {name} retrieval timed out; continuing without it.")
     except Exception as e:
-        print(f"[warn] BM25 fallback failed: {e}")
-        print("Confirm that your index exists. Delete it and rerun bm25_index.py if necessary.")
-        bm25_hits = []
-
-    # Combine + dedupe by (source_file, page_number)
-    seen, combined = set(), []
-    for hit in vector_hits + bm25_hits:
-        meta = hit[1]
-        key = (meta.get("source_file"), meta.get("page_number"))
-        if key not in seen:
-            combined.append(hit)
-            seen.add(key)
-
-    combined.sort(key=lambda x: x[2], reverse=True)
+        metrics.ERRORS.inc(stage=name.lower())
+        print(f"[warn] {name} retrieval failed: {e}")
+        if hint:
+            print(hint)
+    return []
+
+def retrieve(query: str, top_k: int = TOP_K):
+    """Hybrid retrieval: dense (Chroma) + lexical (BM25).
+
+    - Runs both legs concurrently, each on its own thread pool, so latency is
+      max(vector, lexical) rather than their sum and a hung leg cannot take
+      the other leg's threads.
+    - Vector leg queries Chroma (via the shared `RetrievalContext`) and
+      converts cosine distance to similarity via `1.0 - distance`.
+    - BM25 leg queries the lexical index and tags results with their source.
+    - Each leg has its own deadline (`VECTOR_TIMEOUT`, `BM25_TIMEOUT`); a leg
+      that fails or misses it is dropped with a warning.
+    - Over-fetches `FUSION_OVERFETCH * top_k` candidates per leg and fuses
+      them with `fusion.fuse` (RRF or normalized weighted sum), so scores from
+      the two legs are comparable and agreement between legs is rewarded.
+    - Deduplicates on (source_file, page_number) to avoid repeated context.
+    - Returns top_k fused results plus retrieval latency in seconds. Hits are
+      (text, meta, score, source, leg_scores): the fused score in [0, 1],
+      the source "vector", "bm25" or "vector+bm25", and each leg's raw score
+      (see `raw_score`).
+    """
+    t0 = time.perf_counter()
+    with tracing.span("retrieve", top_k=top_k) as sp:
+        n_candidates = top_k * max(1, fusion.FUSION_OVERFETCH)
+        vector_future = _VECTOR_POOL.submit(tracing.bind(vector_search), query, n_candidates)
+        bm25_future = _BM25_POOL.submit(tracing.bind(bm25_search), query, n_candidates)
+
+        vector_hits = _leg_result(vector_future, t0 + VECTOR_TIMEOUT, "Vector")
+        bm25_hits = _leg_result(
+            bm25_future, t0 + BM25_TIMEOUT, "BM25",
+            hint="Confirm that your index exists. Delete it and rerun bm25_index.py if necessary.",
+        )
+
+        combined = _fuse_legs(vector_hits, bm25_hits, top_k)
+        sp.set(vector_hits=len(vector_hits), bm25_hits=len(bm25_hits), hits=len(combined))
     t1 = time.perf_counter()
-    return combined[:top_k], (t1 - t0)
+    metrics.RETRIEVAL_SECONDS.observe(t1 - t0)
+    return combined, (t1 - t0)
+
+def raw_score(hit):
+    """Best raw leg score of a hit (cosine similarity or BM25+).
+
+    `MIN_SCORE` and the low-confidence check are absolute thresholds on this
+    scale; fused scores only rank hits against each other. Unfused hits
+    carry their raw score directly.
+    """
+    legs = hit[4] if len(hit) > 4 else None
+    return max(legs.values()) if legs else hit[2]
+
+def _fuse_legs(vector_hits, bm25_hits, top_k):
+    """Fuse both legs onto one scale, then dedupe by (source_file, page_number)."""
+    with tracing.span("fusion", method=fusion.FUSION_METHOD), metrics.FUSION_SECONDS.time():
+        fused = fusion.fuse({"vector": vector_hits, "bm25": bm25_hits})
+        seen, combined = set(), []
+        for hit in fused:
+            meta = hit[1]
+            key = (meta.get("source_file"), meta.get("page_number"))
+            if key not in seen:
+                combined.append(hit)
+                seen.add(key)
+    return combined[:top_k]
+
+async def _aleg_result(future, timeout, name, hint=None):
+    """Async twin of `_leg_result`: await a pool future without holding a thread."""
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=max(0.0, timeout))
+    except asyncio.TimeoutError:
+        metrics.ERRORS.inc(stage=f"{name.lower()}_timeout")
+        print(f"[warn] {name} retrieval timed out; continuing without it.")
+    except Exception as e:
+        metrics.ERRORS.inc(stage=name.lower())
+        print(f"[warn] {name} retrieval failed: {e}")
+        if hint:
+            print(hint)
+    return []
+
+async def aretrieve(query: str, top_k: int = TOP_K):
+    """Async `retrieve` for event-loop callers (the FastAPI app).
+
+    Both legs run on their retrieval pools exactly as in `retrieve`, but
+    the caller awaits them instead of parking a thread, so many concurrent
+    requests only occupy pool threads for the actual search work. Returns
+    (hits, retrieval seconds).
+    """
+    t0 = time.perf_counter()
+    with tracing.span("retrieve", top_k=top_k) as sp:
+        n_candidates = top_k * max(1, fusion.FUSION_OVERFETCH)
+        vector_future = _VECTOR_POOL.submit(tracing.bind(vector_search), query, n_candidates)
+        bm25_future = _BM25_POOL.submit(tracing.bind(bm25_search), query, n_candidates)
+
+        vector_hits, bm25_hits = await asyncio.gather(
+            _aleg_result(vector_future, VECTOR_TIMEOUT, "Vector"),
+            _aleg_result(
+                bm25_future, BM25_TIMEOUT, "BM25",
+                hint="Confirm that your index exists. Delete it and rerun bm25_index.py if necessary.",
+            ),
+        )
+        # Fusion is pure Python over a few dozen hits; cheap enough for the loop
+        combined = _fuse_legs(vector_hits, bm25_hits, top_k)
+        sp.set(vector_hits=len(vector_hits), bm25_hits=len(bm25_hits), hits=len(combined))
+    t_retrieval = time.perf_counter() - t0
+    metrics.RETRIEVAL_SECONDS.observe(t_retrieval)
+    return combined, t_retrieval
 
 # ------------------------------------
 # Prompt construction
 # ------------------------------------
-def build_prompt(query, hits):
+def build_prompt(query, hits, stats=None):
+    """Create a prompt with cleaned, deduped, and tagged context (see `_build_prompt`).
+
+    Records the `build_prompt` span and latency metric.
+    """
+    stats = {} if stats is None else stats
+    with tracing.span("build_prompt", hits=len(hits)) as sp, metrics.PROMPT_BUILD_SECONDS.time():
+        prompt = _build_prompt(query, hits, stats)
+        sp.set(**stats)
+    return prompt
+
+def _build_prompt(query, hits, stats=None):
     """Create a prompt with cleaned, deduped, and tagged context.
 
-    - Normalizes hit tuples to (text, meta, score, source).
-    - Filters by `MIN_SCORE`, with a small fallback context if none pass.
+    - Normalizes hit tuples to (text, meta, score, source, raw score).
+    - Filters by `MIN_SCORE` on each hit's raw leg scores (`raw_score`), with
+      a small fallback context if none pass.
     - Labels each block with filename, page, and the source type (vector/bm25).
-    - Truncates overly long context to keep prompt size reasonable.
+    - Packs blocks, best score first, into the `CONTEXT_TOKENS` budget,
+      trimming or dropping the lowest-value chunks at sentence boundaries.
+    - If a `stats` dict is passed, fills it with the packing counts and the
+      estimated `prompt_tokens`.
+
+    Every accepted hit shape builds a prompt (`python -m doctest answer_hybsrch.py`):
+
+    >>> meta = {"source_file": "f.pdf", "page_number": 1}
+    >>> shapes = [
+    ...     (("text", meta), 0.9, "vector"),                        # nested
+    ...     ("text", meta, 0.9),                                    # no source
+    ...     ("text", meta, 0.9, "bm25"),                            # unfused
+    ...     ("text", meta, 0.03, "vector+bm25", {"vector": 0.9}),   # fused
+    ... ]
+    >>> all("f.pdf p.1" in _build_prompt("q", [h]) for h in shapes)
+    True
     """
     # --- Flatten & sanitize hits ---
     cleaned_hits = []
@@ -108,7 +323,7 @@ def build_prompt(query, hits):
             text, meta = h[0]
             score = h[1]
             source = h[2] if len(h) > 2 else "unknown"
-            cleaned_hits.append((text, meta, score, source))
+            cleaned_hits.append((text, meta, score, source, score))
 
         # case: (text, meta, score, source) — expected
         elif len(h) >= 3 and isinstance(h[2], (int, float)):
@@ -116,27 +331,23 @@ def build_prompt(query, hits):
             meta = h[1]
             score = h[2]
             source = h[3] if len(h) > 3 else "unknown"
-            cleaned_hits.append((text, meta, score, source))
+            cleaned_hits.append((text, meta, score, source, raw_score(h)))
 
-    # --- Filter by score ---
-    relevant = [h for h in cleaned_hits if h[2] >= MIN_SCORE]
+    # --- Filter by raw score (fused scores are only relative) ---
+    relevant = [h[:4] for h in cleaned_hits if h[4] >= MIN_SCORE]
     if not relevant:
-        relevant = cleaned_hits[:2]
+        relevant = [h[:4] for h in cleaned_hits[:2]]
 
-    # --- Build prompt context ---
-    context_blocks, citations = [], []
-    for i, (chunk, meta, score, source) in enumerate(relevant, 1):
+    # --- Build prompt context within the token budget ---
+    blocks = []
+    for chunk, meta, score, source in sorted(relevant, key=lambda h: h[2], reverse=True):
         src = meta.get("source_file", "?")
         page = meta.get("page_number", "?")
-        label = f"{src} p.{page} [{source}]"
-        context_blocks.append(f"[{i}] {label}\n{chunk}")
-        citations.append(label)
+        blocks.append((f"{src} p.{page} [{source}]", chunk))
 
-    context = "\n\n".join(context_blocks)
-    if len(context) > 8000:
-        context = context[:8000] + "\n… [truncated]"
-
-    cite_note = ", ".join(citations)
+    kept, pack_stats = pack_context(blocks)
+    context = render_context(kept)
+    cite_note = ", ".join(label for label, _ in kept)
     approx_words = approx_tokens_to_words(NUM_PREDICT)
 
     system = textwrap.dedent(f"""
@@ -159,55 +370,102 @@ def build_prompt(query, hits):
     - Use content verbatim where appropriate.
     """).strip()
 
-    return f"<SYSTEM>\n{system}\n</SYSTEM>\n<USER>\n{user}\n</USER>"
+    prompt = f"<SYSTEM>\n{system}\n</SYSTEM>\n<USER>\n{user}\n</USER>"
+    if stats is not None:
+        stats.update(pack_stats, prompt_tokens=estimate_tokens(prompt))
+    return prompt
 
 
 # ------------------------------------
 # Generation
 # ------------------------------------
-def generate(prompt):
-    """Synchronous generation call to Ollama with timing metadata."""
-    t0 = time.perf_counter()
-    r = requests.post(
-        f"{OLLAMA_URL}/api/generate",
-        json={
-            "model": LLM_MODEL,
-            "prompt": prompt,
-            "options": {"temperature": TEMPERATURE, "num_predict": NUM_PREDICT},
-            "stream": False
-        },
-        timeout=ANSWER_TIMEOUT
-    )
-    t1 = time.perf_counter()
-    r.raise_for_status()
-    data = r.json()
+def _generate_payload(prompt, stream):
+    """Request body for Ollama's `/api/generate`."""
+    return {
+        "model": LLM_MODEL,
+        "prompt": prompt,
+        "options": {"temperature": TEMPERATURE, "num_predict": NUM_PREDICT},
+        "stream": stream,
+    }
+
+def record_generation(generation_s, data):
+    """Record generation latency and Ollama's token counters in `metrics`."""
+    metrics.GENERATION_SECONDS.observe(generation_s)
+    if data.get("prompt_eval_count"):
+        metrics.TOKENS.inc(data["prompt_eval_count"], kind="prompt")
+    if data.get("eval_count"):
+        metrics.TOKENS.inc(data["eval_count"], kind="completion")
+
+def _span_counters(span, data):
+    """Attach Ollama's token counters from a final message to a `generate` span."""
+    span.set(eval_count=data.get("eval_count"), prompt_eval_count=data.get("prompt_eval_count"))
 
+def _timing_from(data, generation_s):
+    """Timing/counter dict from Ollama's final message (durations in ns)."""
     def ns_to_s(ns): return (float(ns) / 1e9) if ns is not None else None
-    timing = {
+    return {
         "retrieval_s": None,
-        "generation_s": (t1 - t0),
+        "generation_s": generation_s,
         "eval_count": data.get("eval_count"),
         "prompt_eval_count": data.get("prompt_eval_count"),
         "eval_s": ns_to_s(data.get("eval_duration")),
         "prompt_eval_s": ns_to_s(data.get("prompt_eval_duration")),
         "load_s": ns_to_s(data.get("load_duration")),
     }
-    return data.get("response", "").strip(), timing
+
+def generate(prompt):
+    """Synchronous generation call to Ollama (pooled session) with timing metadata."""
+    t0 = time.perf_counter()
+    with tracing.span("generate", model=LLM_MODEL, stream=False) as sp:
+        r = ollama_client.post(
+            f"{OLLAMA_URL}/api/generate", _generate_payload(prompt, False), timeout=ANSWER_TIMEOUT
+        )
+        t1 = time.perf_counter()
+        data = r.json()
+        _span_counters(sp, data)
+        record_generation(t1 - t0, data)
+    return data.get("response", "").strip(), _timing_from(data, t1 - t0)
+
+async def agenerate(prompt):
+    """Async `generate`: one non-streaming Ollama call on the async client."""
+    t0 = time.perf_counter()
+    with tracing.span("generate", model=LLM_MODEL, stream=False) as sp:
+        data = await ollama_client.apost(
+            f"{OLLAMA_URL}/api/generate", _generate_payload(prompt, False), timeout=ANSWER_TIMEOUT
+        )
+        generation_s = time.perf_counter() - t0
+        _span_counters(sp, data)
+        record_generation(generation_s, data)
+    return data.get("response", "").strip(), _timing_from(data, generation_s)
+
+async def astream_generate(prompt):
+    """Async generator over Ollama's streamed JSON messages (one dict per line).
+
+    Closing the generator early (e.g. `aclose()` on client disconnect)
+    closes the upstream response, which stops Ollama's generation.
+    The `generate` span covers the whole stream and gets the token counters
+    of the final message.
+    """
+    with tracing.span("generate", model=LLM_MODEL, stream=True) as sp:
+        async with ollama_client.astream(
+            f"{OLLAMA_URL}/api/generate", _generate_payload(prompt, True), timeout=ANSWER_TIMEOUT
+        ) as r:
+            async for line in r.aiter_lines():
+                if line:
+                    data = json.loads(line)
+                    if data.get("done"):
+                        _span_counters(sp, data)
+                    yield data
 
 def generate_stream(prompt):
     """Streaming generation from Ollama; prints tokens and returns timing/counters."""
     url = f"{OLLAMA_URL}/api/generate"
-    payload = {
-        "model": LLM_MODEL,
-        "prompt": prompt,
-        "options": {"temperature": TEMPERATURE, "num_predict": NUM_PREDICT},
-        "stream": True
-    }
+    payload = _generate_payload(prompt, True)
 
     t0 = time.perf_counter()
     eval_count = prompt_eval_count = None
 
-    with requests.post(url, json=payload, stream=True, timeout=ANSWER_TIMEOUT) as r:
+    with ollama_client.post(url, payload, timeout=ANSWER_TIMEOUT, stream=True) as r:
         for line in r.iter_lines():
             if not line:
                 continue
@@ -241,12 +499,18 @@ def main():
         print("No results found.")
         return
 
-    best_score = max(h[2] for h in hits)
+    best_score = max(raw_score(h) for h in hits)
     print(f"\nBest match score: {best_score:.3f}")
     if best_score < MIN_SCORE:
         print("⚠️ Low confidence retrieval — answer may be uncertain.\n")
 
-    prompt = build_prompt(query, hits)
+    prompt_stats = {}
+    prompt = build_prompt(query, hits, prompt_stats)
+    print(
+        f"Prompt: ~{prompt_stats['prompt_tokens']} tokens "
+        f"({prompt_stats['chunks_used']} chunks, {prompt_stats['chunks_trimmed']} trimmed, "
+        f"{prompt_stats['chunks_dropped']} dropped)"
+    )
 
     print("\n=== ANSWER ===\n")
     if STREAM_OUTPUT:
@@ -256,8 +520,8 @@ def main():
         print(answer)
 
     print("\n=== TOP MATCHES ===")
-    for i, (_, meta, score, source) in enumerate(hits[:TOP_K], 1):
-        src_tag = "🔹BM25" if source == "bm25" else "🔸Vector"
+    for i, (_, meta, score, source, *_) in enumerate(hits[:TOP_K], 1):
+        src_tag = {"bm25": "🔹BM25", "vector": "🔸Vector"}.get(source, "🔸🔹Hybrid")
         print(f"[{i}] {meta.get('source_file')} p.{meta.get('page_number')} — score={score:.3f} ({src_tag})")
 
     # concise metrics summary
@@ -2,22 +2,87 @@
 
 Exposes a tiny HTTP API that:
 - Serves the static frontend from `static/` at `/`.
-- Answers questions via `/ask?query=...` using `answer_hybsrch` (hybrid vector + BM25).
+- Answers questions via `/ask?query=...` using `answer_hybsrch` (hybrid vector + BM25),
+  either as JSON or as a Server-Sent Events stream (matches, tokens, stats).
+- Serves repeated (or, optionally, near-identical) questions from an answer
+  cache (`answer_cache.py`) without retrieval or generation.
+- Coalesces identical questions asked concurrently (`single_flight.py`), so a
+  burst of the same question runs one retrieval and one Ollama generation
+  whose answer is fanned out to every caller.
+- Admits new answers through a bounded generation queue (`gen_scheduler.py`)
+  and rejects overflow with 429/503 + Retry-After; `/status` reports queue
+  depth, wait times and stream counters.
+- Exposes Prometheus-style metrics at `/metrics` (`metrics.py`): per-stage
+  latency histograms, cache/error/token counters and queue gauges.
+- Traces each request (`tracing.py`) and returns its id as `X-Request-ID`.
+
+The `/ask` path is async end to end: retrieval legs run on their own
+thread pools and are awaited, and Ollama is called through the async
+client in `ollama_client.py`, so a request never ties up a thread while it
+waits. How many answers are generated or queued at once is bounded by the
+generation scheduler (`GEN_CONCURRENCY` + `GEN_QUEUE_MAX`).
 
 Intended for local-only use; host/port are set to loopback by default.
 """
 
-from fastapi import FastAPI, Query
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+import asyncio
+import os
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import answer_hybsrch  # imports retrieve(), build_prompt(), generate()
-import requests, json  # proxy streaming to Ollama when enabled
+import answer_cache
+import fusion
+import metrics
+import tracing
+from embeddings import embed_query
+import ollama_client  # async pooled client used to proxy streaming from Ollama
+from single_flight import SingleFlight
+from gen_scheduler import GenerationScheduler, Overloaded
+import json
 
 # Local-only config (binds to loopback by default)
 LOCAL_HOST = "127.0.0.1"
 LOCAL_PORT = 8000
+# How often a streaming /ask checks whether its client is still connected (seconds)
+DISCONNECT_POLL_S = float(os.getenv("DISCONNECT_POLL_S", "0.5"))
+
+# Accepted shape for a caller-supplied X-Request-ID
+_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+# Share one retrieval + generation between identical in-flight questions
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+
+# Outcome counters for streamed answers (completed vs. abandoned by the client)
+STREAM_COUNTERS = {"completed": 0, "cancelled": 0}
+# In-flight /ask work, keyed on normalized question + generation params
+flights = SingleFlight()
+# Bounded concurrency + wait queue in front of Ollama generation
+scheduler = GenerationScheduler()
+
+# Live figures read at scrape time
+metrics.Callback("rag_generation_active", "Generations holding a slot", lambda: scheduler.active)
+metrics.Callback("rag_generation_queue_depth", "Requests waiting for a generation slot", lambda: scheduler.waiting)
+metrics.Callback("rag_rejected_total", "Requests rejected by admission control", lambda: scheduler.rejected,
+                 kind="counter", labels=["reason"])
+metrics.Callback("rag_streams_total", "Streamed answers by outcome", lambda: STREAM_COUNTERS,
+                 kind="counter", labels=["outcome"])
+metrics.Callback("rag_coalesced_requests_total", "Requests that joined an in-flight identical answer",
+                 lambda: flights.joined, kind="counter")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open Chroma, the embedder and the BM25 index once before serving."""
+    answer_hybsrch.warmup()
+    yield
+    await ollama_client.aclose()
 
-app = FastAPI(title="Local RAG API", description="Local-only RAG web interface")
+app = FastAPI(title="Local RAG API", description="Local-only RAG web interface", lifespan=lifespan)
 # Serve files from the ./static directory under the /static path
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -27,77 +92,334 @@ def home():
     # Returning a path string works with response_class=FileResponse
     return FileResponse("static/index.html")
 
-@app.get("/ask")
-def ask(query: str = Query(..., description="User question")):
-    """Answer a user question using hybrid RAG.
+def cache_params():
+    """Settings that change the answer for a given question; part of the cache key."""
+    return (
+        answer_hybsrch.LLM_MODEL, answer_hybsrch.EMBED_MODEL, answer_hybsrch.TOP_K,
+        answer_hybsrch.TEMPERATURE, answer_hybsrch.NUM_PREDICT, fusion.FUSION_METHOD,
+    )
 
-    Streaming behavior is controlled by `.env` via `answer_hybsrch.STREAM_OUTPUT`.
-    - When false: returns JSON with answer, timing, and matches.
-    - When true: returns a StreamingResponse of plain text tokens and sets
-      an `X-Matches` header with a compact JSON of the matches.
+def summarize_matches(hits):
+    """Compact, JSON-friendly view of the retrieved hits."""
+    return [
+        {
+            "source": h[1].get("source_file"),
+            "page": h[1].get("page_number"),
+            "score": round(h[2], 3),
+            "origin": h[3] if len(h) > 3 else "unknown",
+        }
+        for h in hits
+    ]
+
+def sse(event: str, data) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def lookup_cache(query: str):
+    """Check the answer cache; returns (cache, params, query_vec, cached value, hit kind)."""
+    cache = answer_cache.get_answer_cache()
+    params = cache_params()
+    if cache is None:
+        return None, params, None, None, None
+    query_vec = None
+    if cache.semantic:
+        try:
+            # Blocking HTTP + SQLite; keep it off the event loop
+            loop = asyncio.get_running_loop()
+            query_vec = await loop.run_in_executor(None, embed_query, query)  # also warms the embedding cache
+        except Exception as e:
+            print(f"[warn] Query embedding for the answer cache failed: {e}")
+    cached, kind = cache.lookup(query, params, query_vec)
+    metrics.CACHE_LOOKUPS.inc(result=kind or "miss")
+    return cache, params, query_vec, cached, kind
+
+def stream_stats(final, t0, t_retrieval, t_gen, ttft, n_tokens, prompt_tokens):
+    """Stats event payload from timings and Ollama's final stream message."""
+    t_end = time.perf_counter()
+    eval_count = final.get("eval_count")
+    eval_s = final["eval_duration"] / 1e9 if final.get("eval_duration") else None
+    prompt_eval_s = final["prompt_eval_duration"] / 1e9 if final.get("prompt_eval_duration") else None
+    # Prefer Ollama's own decode timing; fall back to wall clock over streamed chunks
+    if eval_count and eval_s:
+        tokens_per_s = eval_count / eval_s
+    else:
+        tokens_per_s = n_tokens / (t_end - t_gen) if t_end > t_gen else None
+    return {
+        "retrieval_s": t_retrieval,
+        "ttft_s": ttft,
+        "generation_s": t_end - t_gen,
+        "total_s": t_end - t0,
+        "tokens_per_s": tokens_per_s,
+        "prompt_eval_count": final.get("prompt_eval_count"),
+        "eval_count": eval_count,
+        "prompt_eval_s": prompt_eval_s,
+        "eval_s": eval_s,
+        "prompt_tokens_est": prompt_tokens,
+    }
+
+async def cached_events(cached, kind: str, t0: float):
+    """SSE stream replaying a cached answer."""
+    yield sse("matches", {"matches": cached["matches"], "cache": kind})
+    yield sse("token", {"text": cached["answer"]})
+    yield sse("stats", {**cached["timing"], "cache": kind, "total_s": time.perf_counter() - t0})
+
+def cached_json(query: str, cached, kind: str, t0: float):
+    """JSON body for a cached answer."""
+    return {
+        "query": query,
+        "answer": cached["answer"],
+        "timing": {**cached["timing"], "cache_lookup_s": time.perf_counter() - t0},
+        "matches": cached["matches"],
+        "cache": kind,
+    }
+
+async def answer_events(query: str, t0: float, cache, params, query_vec, queue_wait_s: float = 0.0):
+    """SSE stream for one question: `matches`, then `token`s, then `stats`.
+
+    The response starts before retrieval, so clients get their first bytes
+    immediately. Failures are reported as an `error` event.
+    """
+    ttft, parts, final = None, [], {}
+    with tracing.span("answer", stream=True) as sp:
+        try:
+            # Retrieve top matches using vector + BM25 hybrid strategy
+            hits, t_retrieval = await answer_hybsrch.aretrieve(query)
+            matches_summary = summarize_matches(hits)
+            yield sse("matches", {"matches": matches_summary, "retrieval_s": t_retrieval, "cache": "miss"})
+            if not hits:
+                yield sse("token", {"text": "No results found."})
+                yield sse("stats", {"retrieval_s": t_retrieval, "total_s": time.perf_counter() - t0, "cache": "miss"})
+                return
+
+            # Build grounded prompt
+            prompt_stats = {}
+            prompt = answer_hybsrch.build_prompt(query, hits, prompt_stats)
+
+            t_gen = time.perf_counter()
+            async for data in answer_hybsrch.astream_generate(prompt):
+                if data.get("response"):
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                        metrics.TTFT_SECONDS.observe(ttft)
+                    parts.append(data["response"])
+                    yield sse("token", {"text": data["response"]})
+                if data.get("done"):
+                    final = data  # counters and durations only appear in the last message
+
+            stats = stream_stats(final, t0, t_retrieval, t_gen, ttft, len(parts), prompt_stats["prompt_tokens"])
+            stats["queue_wait_s"] = queue_wait_s
+            answer_hybsrch.record_generation(stats["generation_s"], final)
+            STREAM_COUNTERS["completed"] += 1
+            sp.set(ttft_s=ttft, chunks=len(parts), queue_wait_s=queue_wait_s)
+            yield sse("stats", {**stats, "cache": "miss"})
+        except asyncio.CancelledError:
+            # Every client went away: leaving `astream_generate` closed the Ollama stream
+            STREAM_COUNTERS["cancelled"] += 1
+            print(
+                f"[cancel] client disconnected after {time.perf_counter() - t0:.2f}s "
+                f"({len(parts)} chunks streamed); Ollama generation aborted"
+            )
+            raise
+        except Exception as e:
+            metrics.ERRORS.inc(stage="ask")
+            sp.set(error=str(e))
+            print(f"[error] /ask stream failed: {e}")
+            yield sse("error", {"message": str(e)})
+            return
+
+    # Only complete answers are cached
+    if cache is not None and final:
+        cache.store(query, params, {
+            "answer": "".join(parts).strip(),
+            "matches": matches_summary,
+            "timing": stats,
+        }, query_vec)
+
+async def cancel_on_disconnect(request: Request, events):
+    """Relay `events` to the client, cancelling them as soon as it disconnects.
+
+    Events are produced in a separate task while a watcher polls
+    `request.is_disconnected()` every `DISCONNECT_POLL_S`. On disconnect the
+    producer is cancelled mid-await, which unwinds `astream_generate` and
+    closes the upstream Ollama response, even if no token has been sent yet
+    (e.g. during prompt evaluation).
     """
+    queue = asyncio.Queue()
+    end = object()
+    stopped = False
+
+    async def produce():
+        try:
+            async for event in events:
+                queue.put_nowait(event)
+        finally:
+            queue.put_nowait(end)
+
+    def stop():
+        # Cancel exactly once: a repeated cancel would interrupt the upstream
+        # close that the first one set off, leaving Ollama generating
+        nonlocal stopped
+        if not stopped:
+            stopped = True
+            producer.cancel()
+
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_S)
+        stop()
+
+    producer = asyncio.create_task(produce())
+    watcher = asyncio.create_task(watch())
+    try:
+        while True:
+            event = await queue.get()
+            if event is end:
+                break
+            yield event
+    finally:
+        watcher.cancel()
+        stop()
+        # `wait` (unlike `gather`) does not cancel the producer again if this
+        # generator is itself being cancelled
+        await asyncio.wait({producer})
+
+async def answer_json(query: str, t0: float, cache, params, query_vec, queue_wait_s: float = 0.0):
+    """JSON answer for one question (the non-streaming `/ask`)."""
+    try:
+        with tracing.span("answer", stream=False):
+            return await _answer_json(query, t0, cache, params, query_vec, queue_wait_s)
+    except Exception:
+        metrics.ERRORS.inc(stage="ask")
+        raise
+
+async def _answer_json(query, t0, cache, params, query_vec, queue_wait_s):
     # Retrieve top matches using vector + BM25 hybrid strategy
-    hits, _ = answer_hybsrch.retrieve(query)
+    hits, t_retrieval = await answer_hybsrch.aretrieve(query)
     if not hits:
-        return JSONResponse({"answer": "No results found."})
+        return {"answer": "No results found."}
 
     # Build grounded prompt
-    prompt = answer_hybsrch.build_prompt(query, hits)
-
-    if answer_hybsrch.STREAM_OUTPUT:
-        # Prepare compact match summary for clients to render alongside stream
-        matches_summary = [
-            {
-                "source": h[1].get("source_file"),
-                "page": h[1].get("page_number"),
-                "score": round(h[2], 3),
-                "origin": h[3] if len(h) > 3 else "unknown",
-            }
-            for h in hits
-        ]
-
-        def token_stream():
-            url = f"{answer_hybsrch.OLLAMA_URL}/api/generate"
-            payload = {
-                "model": answer_hybsrch.LLM_MODEL,
-                "prompt": prompt,
-                "options": {
-                    "temperature": answer_hybsrch.TEMPERATURE,
-                    "num_predict": answer_hybsrch.NUM_PREDICT,
-                },
-                "stream": True,
-            }
-            with requests.post(
-                url, json=payload, stream=True, timeout=answer_hybsrch.ANSWER_TIMEOUT
-            ) as r:
-                for line in r.iter_lines():
-                    if not line:
-                        continue
-                    data = json.loads(line.decode("utf-8"))
-                    if "response" in data:
-                        yield data["response"]
-
-        return StreamingResponse(
-            token_stream(),
-            media_type="text/plain; charset=utf-8",
-            headers={"X-Matches": json.dumps(matches_summary)},
-        )
+    prompt_stats = {}
+    prompt = answer_hybsrch.build_prompt(query, hits, prompt_stats)
+    matches_summary = summarize_matches(hits)
 
     # Non-streaming JSON response
-    answer_text, timing = answer_hybsrch.generate(prompt)
+    answer_text, timing = await answer_hybsrch.agenerate(prompt)
+    timing["retrieval_s"] = t_retrieval
+    timing["prompt_tokens_est"] = prompt_stats["prompt_tokens"]
+    timing["queue_wait_s"] = queue_wait_s
+    if cache is not None:
+        cache.store(query, params, {"answer": answer_text, "matches": matches_summary, "timing": timing}, query_vec)
     return {
         "query": query,
         "answer": answer_text,
         "timing": timing,
-        "matches": [
-            {
-                "source": h[1].get("source_file"),
-                "page": h[1].get("page_number"),
-                "score": round(h[2], 3),
-                "origin": h[3] if len(h) > 3 else "unknown",
-            }
-            for h in hits
-        ],
+        "matches": matches_summary,
+        "cache": "miss",
+    }
+
+def request_id_for(request: Request) -> str:
+    """The caller's `X-Request-ID` if it is well-formed, else a fresh id."""
+    rid = request.headers.get("x-request-id", "")
+    return rid if _REQUEST_ID.fullmatch(rid) else uuid.uuid4().hex
+
+async def with_request_id(rid: str, trace_id, events):
+    """Prefix an SSE stream with a `request` event naming the request and its trace."""
+    try:
+        yield sse("request", {"request_id": rid, "trace_id": trace_id})
+        async for event in events:
+            yield event
+    finally:
+        await events.aclose()
+
+@app.get("/ask")
+async def ask(request: Request, response: Response, query: str = Query(..., description="User question")):
+    """Answer a user question using hybrid RAG.
+
+    Streaming behavior is controlled by `.env` via `answer_hybsrch.STREAM_OUTPUT`.
+    - When false: returns JSON with answer, timing, and matches.
+    - When true: returns a `text/event-stream` of Server-Sent Events:
+      `matches` (retrieved sources, retrieval time), one `token` per
+      generated chunk, then `stats` (retrieval_s, ttft_s, tokens_per_s,
+      prompt/eval counts, ...) or `error`. If the client disconnects, the
+      upstream Ollama generation is aborted and counted as cancelled.
+
+    Identical questions already being answered are not recomputed: the
+    caller shares the in-flight answer (streams replay what was already sent).
+    Cached answers are returned immediately in either mode; the `cache`
+    field (JSON, or the matches/stats events) reports "exact", "semantic" or
+    "miss".
+
+    Other questions wait for a generation slot first; when the wait queue is
+    full the request fails fast with 429, and after `GEN_QUEUE_TIMEOUT`
+    seconds of waiting with 503, both with a `Retry-After` header.
+
+    Every response carries an `X-Request-ID` header (the caller's, if sent);
+    JSON bodies add `request_id`/`trace_id` and streams start with a
+    `request` event. The request is traced (`tracing.py`): cache lookup,
+    admission, retrieval legs, prompt build and generation spans.
+    """
+    t0 = time.perf_counter()
+    rid = request_id_for(request)
+    ids = {"X-Request-ID": rid}
+    stream = answer_hybsrch.STREAM_OUTPUT
+    sse_headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **ids}
+    with tracing.trace("ask", request_id=rid, stream=stream) as root:
+        with tracing.span("cache_lookup") as sp:
+            cache, params, query_vec, cached, kind = await lookup_cache(query)
+            sp.set(result=kind or ("miss" if cache is not None else "disabled"))
+        if cached is not None:
+            if stream:
+                return StreamingResponse(with_request_id(rid, root.trace_id, cached_events(cached, kind, t0)),
+                                         media_type="text/event-stream", headers=sse_headers)
+            response.headers.update(ids)
+            return {**cached_json(query, cached, kind, t0), "request_id": rid, "trace_id": root.trace_id}
+
+        # Without coalescing every request gets a key of its own
+        key = (answer_cache.normalize_query(query), params) if COALESCE_REQUESTS else object()
+        slot = None
+        if not flights.is_running(key):
+            with tracing.span("admission") as sp:
+                try:
+                    slot = await scheduler.acquire()
+                    metrics.QUEUE_WAIT_SECONDS.observe(slot.wait_s)
+                    sp.set(wait_s=slot.wait_s, queue_depth=scheduler.waiting)
+                except Overloaded as e:
+                    sp.set(rejected=e.status_code)
+                    print(f"[busy] /ask {rid} rejected ({e.status_code}): {e.reason}")
+                    raise HTTPException(status_code=e.status_code, detail=e.reason,
+                                        headers={"Retry-After": str(e.retry_after), **ids})
+        root.set(coalesced=flights.is_running(key))
+        # The slot is held until the answer it admitted is done (released at once
+        # if an identical question took the lead while this one was queued)
+        on_finish = slot.release if slot is not None else None
+        args = (query, t0, cache, params, query_vec, slot.wait_s if slot is not None else 0.0)
+
+        if stream:
+            # Work spans started here outlive this root span and are exported when they end
+            events = flights.subscribe(key, lambda: answer_events(*args), on_finish)
+            return StreamingResponse(
+                cancel_on_disconnect(request, with_request_id(rid, root.trace_id, events)),
+                media_type="text/event-stream",
+                headers=sse_headers,
+            )
+        result = await flights.do(key, lambda: answer_json(*args), on_finish)
+        response.headers.update(ids)
+        return {**result, "request_id": rid, "trace_id": root.trace_id}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus text exposition of the pipeline metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/status")
+def status():
+    """Live load figures: generation queue, in-flight answers and stream outcomes."""
+    return {
+        "generation": scheduler.snapshot(),
+        "in_flight": flights.in_flight(),
+        "coalesced": {"started": flights.started, "joined": flights.joined},
+        "streams": dict(STREAM_COUNTERS),
     }
 
 if __name__ == "__main__":
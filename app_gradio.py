@@ -21,6 +21,9 @@ def chat_fn(message, history):
 
     return f"{answer}\n\n---\n**Sources:**\n{sources}"
 
+# Open Chroma, the embedder and the BM25 index once, before the first chat
+answer_hybsrch.warmup()
+
 # Gradio chat interface
 gr.ChatInterface(
     fn=chat_fn,
@@ -0,0 +1,147 @@
+"""Benchmark BM25 top-k: MaxScore pruning vs. exhaustive scoring.
+
+Times `bm25_query.top_k_bm25` (MaxScore over the mmap'd segment postings,
+with its short-query fallback) against the exhaustive vectorized
+`bm25_query.score_bm25` followed by a top-k selection, and checks that both
+return the same top-k scores.
+
+By default it runs on a synthetic corpus: `--docs` chunks of 80–320 tokens
+drawn from a Zipf-distributed vocabulary, written as `--segments` segments
+with `bm25_index.add_documents`. The index is built once per size under
+`data/bench/` and reused. Queries mix rare, mid-frequency and common terms,
+since pruning pays off when rare terms raise the threshold early enough to
+leave the long postings of common terms unscanned:
+
+- `rare+common`: 1 rare and 2 common terms
+- `mid+common`:  2 mid-frequency terms and 1 common term
+- `long`:        1 rare, 1 mid-frequency and 3 common terms
+- `all-common`:  3 common terms (little to prune)
+
+`--index PATH --golden data/golden_queries.json` benchmarks an existing
+index with real questions instead.
+
+Usage:
+    python bench_bm25.py                 # 300k synthetic chunks
+    python bench_bm25.py --docs 1000000 --segments 8
+"""
+
+import os, json, time, argparse, statistics
+import numpy as np
+import bm25_index
+import bm25_query
+
+RESULTS_DIR = "./data/bench"
+VOCAB_SIZE = 100_000
+ZIPF_S = 1.0
+# Vocabulary ranks per term class (rank 0 is the most frequent term)
+RARE = (5_000, 50_000)
+MID = (300, 3_000)
+COMMON = (5, 100)
+SHAPES = {
+    "rare+common": (RARE, COMMON, COMMON),
+    "mid+common": (MID, MID, COMMON),
+    "long": (RARE, MID, COMMON, COMMON, COMMON),
+    "all-common": (COMMON, COMMON, COMMON),
+}
+
+def word(rank):
+    return f"t{rank:06d}"
+
+def build_synthetic(path, n_docs, n_segments, seed=0):
+    """Write a seeded synthetic corpus as `n_segments` BM25 segments at `path`."""
+    rng = np.random.default_rng(seed)
+    p = 1.0 / np.arange(1, VOCAB_SIZE + 1) ** ZIPF_S
+    cdf = np.cumsum(p / p.sum())
+    words = np.array([word(r) for r in range(VOCAB_SIZE)])
+
+    os.makedirs(os.path.join(path, "segments"), exist_ok=True)
+    with bm25_index.writer_lock(path):
+        bm25_index.publish_manifest(path, bm25_index.empty_manifest())
+
+    per_segment = -(-n_docs // n_segments)
+    for start in range(0, n_docs, per_segment):
+        t0 = time.perf_counter()
+        n = min(per_segment, n_docs - start)
+        lengths = rng.integers(80, 321, size=n)
+        tokens = np.searchsorted(cdf, rng.random(int(lengths.sum())))
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        docs = [" ".join(words[tokens[bounds[i]:bounds[i + 1]]]) for i in range(n)]
+        ids = [f"synthetic-{start + i}" for i in range(n)]
+        metas = [{"source_file": "synthetic", "page_number": start + i} for i in range(n)]
+        bm25_index.add_documents(ids, docs, metas, index_path=path)
+        print(f"[bm25] segment of {n} synthetic chunks written in {time.perf_counter() - t0:.1f}s")
+
+def synthetic_queries(per_shape, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for shape, classes in SHAPES.items():
+        for _ in range(per_shape):
+            terms = []
+            for lo, hi in classes:
+                term = word(int(rng.integers(lo, hi)))
+                while term in terms:
+                    term = word(int(rng.integers(lo, hi)))
+                terms.append(term)
+            queries.append((shape, " ".join(terms)))
+    return queries
+
+def golden_queries(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [("golden", entry["query"]) for entry in json.load(f)]
+
+def time_ms(fn, repeat):
+    """Median wall time of `fn()` over `repeat` runs, in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+def main():
+    """CLI entry: build or open the index, time both scorers per query shape."""
+    parser = argparse.ArgumentParser(description="Compare MaxScore top-k with exhaustive BM25 scoring.")
+    parser.add_argument("--docs", type=int, default=300_000, help="synthetic chunks (default: 300000)")
+    parser.add_argument("--segments", type=int, default=4, help="synthetic segments (default: 4)")
+    parser.add_argument("--index", help="benchmark this existing index instead of a synthetic one")
+    parser.add_argument("--golden", help="golden query set to use as queries (with --index)")
+    parser.add_argument("--queries", type=int, default=10, help="synthetic queries per shape (default: 10)")
+    parser.add_argument("-k", type=int, default=10, help="results per query (default: 10)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per query (default: 5)")
+    args = parser.parse_args()
+
+    path = args.index or os.path.join(RESULTS_DIR, f"bm25-synthetic-{args.docs}x{args.segments}")
+    if not args.index and not bm25_index.index_exists(path):
+        print(f"[→] Building synthetic BM25 index at {path} ...")
+        build_synthetic(path, args.docs, args.segments)
+    index = bm25_query.load_index(path)
+    if index is None:
+        raise SystemExit(f"No BM25 index at {path}")
+    print(f"Index: {index.N} docs in {len(index.segments)} segment(s), k={args.k}, "
+          f"fallback below {bm25_query.PRUNE_MIN_POSTINGS} postings")
+
+    queries = golden_queries(args.golden) if args.golden else synthetic_queries(args.queries)
+    rows = []
+    for shape, text in queries:
+        tokens = bm25_query.tokenize(text)
+        exhaustive = lambda: bm25_query._top_k_exhaustive(tokens, index, args.k)
+        maxscore = lambda: bm25_query.top_k_bm25(tokens, index, args.k)
+        expected, got = exhaustive(), maxscore()  # also warms the pages
+        if not np.allclose([s for _, s in expected], [s for _, s in got], rtol=1e-9):
+            print(f"[error] top-k mismatch for {text!r}:\n  exhaustive {expected}\n  maxscore   {got}")
+        postings = sum((index.term_postings(t) or (None, 0))[1] for t in set(tokens))
+        rows.append((shape, postings, time_ms(exhaustive, args.repeat), time_ms(maxscore, args.repeat)))
+
+    print(f"\n{'shape':<13}{'queries':>8}{'postings':>10}{'exhaustive ms':>15}{'maxscore ms':>13}{'speedup':>9}")
+    for shape in dict.fromkeys(r[0] for r in rows):
+        sel = [r for r in rows if r[0] == shape]
+        ex = statistics.median(r[2] for r in sel)
+        ms = statistics.median(r[3] for r in sel)
+        postings = int(statistics.median(r[1] for r in sel))
+        print(f"{shape:<13}{len(sel):>8}{postings:>10}{ex:>15.2f}{ms:>13.2f}{ex / ms:>8.1f}x")
+    ex_all = sum(r[2] for r in rows)
+    ms_all = sum(r[3] for r in rows)
+    print(f"{'total':<13}{len(rows):>8}{'':>10}{ex_all:>15.2f}{ms_all:>13.2f}{ex_all / ms_all:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""Offline retrieval benchmark against a golden query set.
+
+Runs each labeled query through three retrievers, exactly as the app calls
+them, and measures speed and quality so that changes to `CHUNK_SIZE`,
+`TOP_K` or fusion settings can be compared between commits:
+
+- `vector`: dense search as in `query.py` (cached query embedding + Chroma
+  top-k), via `answer_hybsrch.vector_search`
+- `bm25`:   `bm25_query.query_bm25`
+- `hybrid`: `answer_hybsrch.retrieve` (both legs, fusion, page dedup)
+
+Reported per retriever:
+- latency p50/p95/p99/mean/max in milliseconds and QPS over all timed calls
+- recall@k (share of a query's relevant pages in its top k), hit@k (any
+  relevant page in the top k) and MRR (1 / rank of the first relevant page),
+  averaged over queries; hits are matched on (source_file, page_number) and
+  repeated pages count once
+
+The golden set (`data/golden_queries.json`) is a JSON list of
+`{"id", "query", "relevant": {source_file: [page numbers]}}`.
+
+Usage:
+    python bench_retrieval.py --out data/bench/base.json
+    # ...change settings, re-ingest...
+    python bench_retrieval.py --compare data/bench/base.json
+
+Results (summary, per-query ranks and the settings in effect) are written to
+`--out` (default `data/bench/retrieval-<commit>.json`). `--compare` prints
+the change against an earlier result file; with `--fail-on-regression` the
+exit code is 1 when quality drops or p95 latency grows beyond `--tolerance`.
+
+Uses the pipeline's own configuration (`CHROMA_DIR`, `BM25_INDEX_PATH`,
+`TOP_K`, `FUSION_*`, ...). Query embeddings are served from the embedding
+cache after the warm-up pass; set `EMBED_CACHE=false` to include the Ollama
+round trip in every vector and hybrid query.
+"""
+
+import os, sys, json, time, argparse, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import answer_hybsrch
+import bm25_query
+import fusion
+
+# ------------------------------------
+# Config
+# ------------------------------------
+load_dotenv()
+GOLDEN_PATH = "./data/golden_queries.json"
+RESULTS_DIR = "./data/bench"
+RETRIEVERS = ("vector", "bm25", "hybrid")
+QUALITY_KEYS = ("recall_at_k", "hit_at_k", "mrr")
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms", "mean_ms")
+
+# ------------------------------------
+# Retrievers (each returns hit metadata, best first)
+# ------------------------------------
+def run_vector(query, k):
+    return [meta for _, meta, _, _ in answer_hybsrch.vector_search(query, k)]
+
+def run_bm25(query, k):
+    return [meta for _, meta, _ in bm25_query.query_bm25(query, top_k=k)]
+
+def run_hybrid(query, k):
+    hits, _ = answer_hybsrch.retrieve(query, top_k=k)
+    return [meta for _, meta, *_ in hits]
+
+_RUNNERS = {"vector": run_vector, "bm25": run_bm25, "hybrid": run_hybrid}
+
+# ------------------------------------
+# Scoring
+# ------------------------------------
+def load_golden(path: str):
+    """Load the golden set as a list of {id, query, relevant: {(source, page), ...}}."""
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    golden = []
+    for i, entry in enumerate(entries):
+        relevant = {(src, int(page)) for src, pages in entry["relevant"].items() for page in pages}
+        if not entry.get("query") or not relevant:
+            raise ValueError(f"{path}: entry {i} needs a query and at least one relevant page")
+        golden.append({"id": entry.get("id", str(i)), "query": entry["query"], "relevant": relevant})
+    return golden
+
+def ranked_pages(metas):
+    """(source_file, page_number) of each hit in rank order, first occurrence only."""
+    pages = []
+    for meta in metas:
+        key = (meta.get("source_file"), meta.get("page_number"))
+        if key not in pages:
+            pages.append(key)
+    return pages
+
+def score_query(pages, relevant):
+    """recall@k, hit@k and reciprocal rank of one ranked page list."""
+    found = [i for i, page in enumerate(pages, start=1) if page in relevant]
+    return {
+        "recall_at_k": len(found) / len(relevant),
+        "hit_at_k": 1.0 if found else 0.0,
+        "mrr": 1.0 / found[0] if found else 0.0,
+    }
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+# ------------------------------------
+# Benchmark
+# ------------------------------------
+def bench_retriever(name, golden, k, repeat, concurrency):
+    """Warm up once, then time `repeat` passes over the golden set and score the results."""
+    run = _RUNNERS[name]
+    for item in golden:
+        run(item["query"], k)  # loads indexes/models and fills the embedding cache
+
+    def timed(item):
+        t0 = time.perf_counter()
+        metas = run(item["query"], k)
+        return item, time.perf_counter() - t0, metas
+
+    jobs = [item for _ in range(repeat) for item in golden]
+    t0 = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(timed, jobs))
+    else:
+        results = [timed(item) for item in jobs]
+    wall_s = time.perf_counter() - t0
+
+    latencies = sorted(dt for _, dt, _ in results)
+    per_query = {}
+    for item, dt, metas in results:
+        row = per_query.get(item["id"])
+        if row is None:
+            # Retrieval is deterministic; score the first timed pass
+            pages = ranked_pages(metas)[:k]
+            row = per_query[item["id"]] = {
+                "query": item["query"],
+                "pages": [[src, page] for src, page in pages],
+                **score_query(pages, item["relevant"]),
+                "latencies_ms": [],
+            }
+        row["latencies_ms"].append(dt * 1000)
+    for row in per_query.values():
+        row["p50_ms"] = percentile(sorted(row.pop("latencies_ms")), 0.50)
+
+    summary = {
+        "queries": len(golden),
+        "calls": len(results),
+        "qps": len(results) / wall_s if wall_s else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+    for key in QUALITY_KEYS:
+        summary[key] = sum(row[key] for row in per_query.values()) / len(per_query)
+    return {"summary": summary, "per_query": per_query}
+
+def git_commit():
+    """Short hash of HEAD (with `-dirty` for local changes), or None outside git."""
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return sha + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def settings(k, repeat, concurrency, golden_path):
+    """Parameters that affect the results, stored alongside them."""
+    return {
+        "k": k,
+        "repeat": repeat,
+        "concurrency": concurrency,
+        "golden": golden_path,
+        "chroma_dir": answer_hybsrch.CHROMA_DIR,
+        "bm25_index_path": bm25_query.INDEX_PATH,
+        "embed_model": answer_hybsrch.EMBED_MODEL,
+        "fusion_method": fusion.FUSION_METHOD,
+        "fusion_overfetch": fusion.FUSION_OVERFETCH,
+        "chunk_size": os.getenv("CHUNK_SIZE"),
+        "chunk_overlap": os.getenv("CHUNK_OVERLAP"),
+        "embed_cache": os.getenv("EMBED_CACHE", "true"),
+    }
+
+# ------------------------------------
+# Reporting
+# ------------------------------------
+def _num(v, digits):
+    return "–" if v is None else f"{v:.{digits}f}"
+
+def print_summary(results):
+    print(f"\n{'retriever':<10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'QPS':>9}{'recall@k':>10}{'hit@k':>8}{'MRR':>7}")
+    for name, res in results["retrievers"].items():
+        if "error" in res:
+            print(f"{name:<10}  failed: {res['error']}")
+            continue
+        s = res["summary"]
+        print(
+            f"{name:<10}{_num(s['p50_ms'], 2):>9}{_num(s['p95_ms'], 2):>9}{_num(s['p99_ms'], 2):>9}"
+            f"{_num(s['qps'], 1):>9}{s['recall_at_k']:>10.3f}{s['hit_at_k']:>8.3f}{s['mrr']:>7.3f}"
+        )
+
+def compare(results, baseline, tolerance):
+    """Print metric changes against `baseline`; return the list of regressions."""
+    print(f"\n--- vs {baseline.get('commit') or 'baseline'} ({baseline.get('created')}) ---")
+    old_settings = baseline.get("settings", {})
+    for key, value in results["settings"].items():
+        if old_settings.get(key) != value:
+            print(f"[note] {key}: {old_settings.get(key)} -> {value}")
+    regressions = []
+    for name, res in results["retrievers"].items():
+        old = baseline.get("retrievers", {}).get(name, {}).get("summary")
+        if "error" in res or not old:
+            continue
+        new = res["summary"]
+        parts = []
+        for key in QUALITY_KEYS:
+            delta = new[key] - old[key]
+            parts.append(f"{key} {old[key]:.3f}->{new[key]:.3f}")
+            if delta < -1e-9:
+                regressions.append(f"{name} {key} {old[key]:.3f} -> {new[key]:.3f}")
+        for key in LATENCY_KEYS:
+            change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+            parts.append(f"{key} {change:+.0%}")
+            if key == "p95_ms" and change > tolerance:
+                regressions.append(f"{name} p95 {old[key]:.2f}ms -> {new[key]:.2f}ms ({change:+.0%})")
+        print(f"{name:<10}" + " | ".join(parts))
+        for qid, row in res["per_query"].items():
+            old_row = baseline["retrievers"][name].get("per_query", {}).get(qid)
+            if old_row and row["mrr"] != old_row["mrr"]:
+                print(f"    {qid}: MRR {old_row['mrr']:.3f} -> {row['mrr']:.3f}")
+    for r in regressions:
+        print(f"[regression] {r}")
+    return regressions
+
+# ------------------------------------
+# Main
+# ------------------------------------
+def main():
+    """CLI entry: benchmark the retrievers, save JSON results, optionally compare."""
+    parser = argparse.ArgumentParser(description="Benchmark retrieval latency and quality on a golden query set.")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help=f"golden query set (default: {GOLDEN_PATH})")
+    parser.add_argument("-k", type=int, default=answer_hybsrch.TOP_K, help="results per query (default: TOP_K)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed passes over the query set (default: 5)")
+    parser.add_argument("--concurrency", type=int, default=1, help="queries in flight at once (default: 1)")
+    parser.add_argument(
+        "--retrievers", default=",".join(RETRIEVERS),
+        help=f"comma-separated subset of {', '.join(RETRIEVERS)}",
+    )
+    parser.add_argument("--out", help=f"result file (default: {RESULTS_DIR}/retrieval-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed p95 latency growth (default: 0.10)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if --compare finds a regression")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.retrievers.split(",") if n.strip()]
+    unknown = set(names) - set(RETRIEVERS)
+    if unknown:
+        parser.error(f"unknown retrievers: {', '.join(sorted(unknown))}")
+    golden = load_golden(args.golden)
+    print(f"Benchmarking {', '.join(names)} on {len(golden)} queries (k={args.k}, {args.repeat} passes, concurrency {args.concurrency})")
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": settings(args.k, args.repeat, args.concurrency, args.golden),
+        "retrievers": {},
+    }
+    for name in names:
+        t0 = time.perf_counter()
+        try:
+            results["retrievers"][name] = bench_retriever(name, golden, args.k, args.repeat, max(1, args.concurrency))
+        except Exception as e:
+            print(f"[warn] {name} benchmark failed: {e}")
+            results["retrievers"][name] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        print(f"[✓] {name} done in {time.perf_counter() - t0:.1f}s")
+
+    print_summary(results)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"retrieval-{commit or time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance) and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,99 @@
-"""Build a lightweight BM25/BM25+ compatible index from ChromaDB.
+"""Build and maintain a lightweight BM25/BM25+ compatible index from ChromaDB.
 
-This script reads all documents from the `docs` collection in a persistent
-ChromaDB store and constructs a simple JSON index with token statistics used by
-BM25-style retrieval (term frequency, document frequency, document lengths,
-average document length, and lookups for texts/metadatas/ids).
+The lexical index is a set of immutable, memory-mappable segments plus a small
+JSON manifest listing the live segments and their deleted documents
+(tombstones). Each segment is a directory of flat numpy arrays plus a separate
+text store:
+
+    <BM25_INDEX_PATH>/
+    ├── CURRENT                  # name of the live manifest file
+    ├── manifest-000007.json     # layout version, BM25 params, segments + tombstones
+    └── segments/
+        └── seg-000003/
+            ├── meta.json        # N, total token count, counts, layout version
+            ├── vocab.npy        # sorted vocabulary (utf-8 bytes, fixed width)
+            ├── offsets.npy      # int64 postings offsets, len(vocab) + 1
+            ├── doc_ids.npy      # int32 local doc ordinals, ascending within a term
+            ├── tfs.npy          # int32 term frequencies aligned with doc_ids
+            ├── max_tf.npy       # int32 largest tf in each term's postings
+            ├── min_len.npy      # int32 shortest doc length in each term's postings
+            ├── doc_len.npy      # int32 tokenized length per local doc ordinal
+            ├── ids.npy          # Chroma chunk id per local doc ordinal (utf-8 bytes)
+            ├── docs.bin         # one JSON record {id, text, meta} per ordinal
+            └── docs_offsets.npy # int64 byte offsets into docs.bin, N + 1
+
+Corpus statistics (N, avgdl, document frequencies, IDF) are derived by the
+reader from the live segments, so adding or deleting chunks never rewrites
+existing segments:
+
+- `add_documents` writes new chunks as one more segment (upsert semantics).
+- `delete_documents` records tombstones in the manifest. Chunk ids are
+  resolved to local ordinals through a per-segment id -> ordinal table
+  (`id_lookup`), built once per segment on first use and cached for the life
+  of the process, so each later delete is a binary search per id rather
+  than a scan of every segment's `ids.npy`.
+- When there are too many segments, or a segment is mostly deleted, the
+  affected segments are merged into one, dropping tombstoned docs.
+
+Merges never re-tokenize or load whole segments: `merge_segments` walks the
+sorted vocabularies of its inputs in lockstep (a k-way merge) and streams
+remapped postings, lengths, ids and text records straight into the output
+files, so memory stays bounded by the vocabulary rather than the corpus.
+
+Every change writes a new manifest and atomically swaps `CURRENT`, so readers
+(see `bm25_query.py`) keep serving from the previous manifest's mmaps until
+they notice the switch. Running this script rebuilds everything from Chroma
+as a single segment: the collection is paged through with `offset/limit`,
+each page is spilled to disk as a sorted run (a temporary segment), and the
+runs are merged external-sort style, so a full build fits in bounded memory
+regardless of corpus size.
 
 Notes
 - Assumes documents were previously ingested into the `docs` collection
-  (e.g., via `ingest.py`).
-- The output JSON is consumed by `bm25_query.py` for scoring queries.
+  (e.g., via `ingest.py`, which also keeps an existing index up to date).
+- Writers are serialized across processes with a `LOCK` file.
 """
 
 import os
 import json
+import time
+import heapq
+import shutil
+from contextlib import contextmanager
+from itertools import groupby
 from pathlib import Path
 from dotenv import load_dotenv
 import chromadb
+import numpy as np
+from numpy.lib.format import open_memmap
 from collections import defaultdict
 
 # Load configuration from environment (with defaults)
 load_dotenv()
 CHROMA_DIR = os.getenv("CHROMA_DIR", "./data/chroma")
-INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./data/bm25_index.json")
+INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./data/bm25_index")
+# Merge policy: cap on live segments, how many to merge at once, and the
+# deleted fraction that forces a segment to be rewritten
+MAX_SEGMENTS = int(os.getenv("BM25_MAX_SEGMENTS", "8"))
+MERGE_FACTOR = int(os.getenv("BM25_MERGE_FACTOR", "4"))
+MAX_DELETED_RATIO = float(os.getenv("BM25_MAX_DELETED_RATIO", "0.3"))
+# Full builds: chunks fetched from Chroma per page (each page becomes one
+# sorted run on disk) and how many runs are merged at once
+BUILD_PAGE = int(os.getenv("BM25_BUILD_PAGE", "5000"))
+MERGE_FANIN = int(os.getenv("BM25_MERGE_FANIN", "64"))
+# Rows processed per slice while streaming arrays during merges
+_SLICE = 1 << 18
+# Per-segment id -> local ordinal tables, keyed by segment directory.
+# Segments are immutable, so an entry only goes stale once it is merged away.
+_ID_LOOKUPS = {}
+
+# Bump when the on-disk layout changes; readers rebuild older indexes.
+INDEX_VERSION = 6
+
+# BM25+ hyperparameters recorded in the manifest for the reader
+K1 = 1.5
+B = 0.75
+DELTA = 1.0
 
 # Tokenization helper
 def tokenize(text):
@@ -35,67 +107,497 @@ def tokenize(text):
     """
     return [w.lower() for w in text.split() if w.isalnum() and len(w) > 2]
 
-def build_bm25_index():
-    """Build and persist BM25 statistics from the `docs` collection.
+# ------------------------------------
+# Segments
+# ------------------------------------
+def write_segment(out_dir, ids, documents, metadatas):
+    """Write one immutable segment for the given documents into `out_dir`.
 
-    Constructs:
-    - tf: term frequencies per doc_id
-    - df: document frequencies per token
-    - doc_len: tokenized length per document
-    - avgdl: average document length
-    - ids, texts, metas: passthrough lists from Chroma to enable lookups
+    Documents are addressed by their position in `ids`/`documents` (the dense
+    local doc ordinal). Returns the segment's `meta.json` contents.
     """
-    client = chromadb.PersistentClient(path=CHROMA_DIR)
-    col = client.get_or_create_collection(name="docs")
-
-    # Retrieve all stored chunks and metadata
-    result = col.get(include=["documents", "metadatas"], limit=None)
-    documents = result["documents"]
-    metadatas = result["metadatas"]
-    ids = result["ids"]
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
 
     N = len(documents)
-    # Document frequency: number of docs containing a token at least once
-    df = defaultdict(int)
-    # Term frequency per doc: tf[doc_id][token] = count in that doc
-    tf = defaultdict(lambda: defaultdict(int))
-    # Document lengths: number of tokens per document
-    doc_len = {}
-
-    for i, doc in enumerate(documents):
-        doc_id = ids[i]
-        tokens = tokenize(doc)
-        doc_len[doc_id] = len(tokens)
-
-        # Use a set to count each token once for DF
-        seen = set()
-        for token in tokens:
-            tf[doc_id][token] += 1
-            if token not in seen:
-                df[token] += 1
-                seen.add(token)
-
-    # Average document length across the corpus
-    avgdl = sum(doc_len.values()) / N
-
-    # Package index data for downstream BM25 scoring
-    index = {
-        "avgdl": avgdl,
+    # Postings: postings[token] = ([doc ordinals], [counts]) in ordinal order
+    postings = defaultdict(lambda: ([], []))
+    doc_len = np.zeros(N, dtype=np.int32)
+    doc_offsets = np.zeros(N + 1, dtype=np.int64)
+
+    with open(out_dir / "docs.bin", "wb") as store:
+        for ordinal, doc in enumerate(documents):
+            tokens = tokenize(doc)
+            doc_len[ordinal] = len(tokens)
+
+            counts = defaultdict(int)
+            for token in tokens:
+                counts[token] += 1
+            # Ordinals are visited in ascending order, so postings stay sorted
+            for token, count in counts.items():
+                plist = postings[token]
+                plist[0].append(ordinal)
+                plist[1].append(count)
+
+            # Text store: one compact JSON record per document
+            record = json.dumps(
+                {"id": ids[ordinal], "text": doc, "meta": metadatas[ordinal]},
+                ensure_ascii=False, separators=(",", ":"),
+            ).encode("utf-8")
+            store.write(record)
+            doc_offsets[ordinal + 1] = doc_offsets[ordinal] + len(record)
+
+    # Sorted vocabulary with postings laid out contiguously in the same order
+    vocab = sorted(postings)
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    for i, token in enumerate(vocab):
+        offsets[i + 1] = offsets[i] + len(postings[token][0])
+    doc_ids = np.empty(offsets[-1], dtype=np.int32)
+    tfs = np.empty(offsets[-1], dtype=np.int32)
+    # Per-term bounds used by the dynamic-pruning top-k scorer (MaxScore)
+    max_tf = np.empty(len(vocab), dtype=np.int32)
+    min_len = np.empty(len(vocab), dtype=np.int32)
+    for i, token in enumerate(vocab):
+        ords, counts = postings.pop(token)
+        doc_ids[offsets[i]:offsets[i + 1]] = ords
+        tfs[offsets[i]:offsets[i + 1]] = counts
+        max_tf[i] = max(counts)
+        min_len[i] = doc_len[ords].min()
+
+    np.save(out_dir / "vocab.npy", np.array([t.encode("utf-8") for t in vocab], dtype=bytes))
+    np.save(out_dir / "offsets.npy", offsets)
+    np.save(out_dir / "doc_ids.npy", doc_ids)
+    np.save(out_dir / "tfs.npy", tfs)
+    np.save(out_dir / "max_tf.npy", max_tf)
+    np.save(out_dir / "min_len.npy", min_len)
+    np.save(out_dir / "doc_len.npy", doc_len)
+    np.save(out_dir / "docs_offsets.npy", doc_offsets)
+    np.save(out_dir / "ids.npy", np.array([i.encode("utf-8") for i in ids], dtype=bytes))
+
+    meta = {
+        "version": INDEX_VERSION,
         "N": N,
-        "doc_len": doc_len,
-        "tf": tf,
-        "df": df,
-        "ids": ids,
-        "texts": documents,
-        "metas": metadatas,
+        "total_len": int(doc_len.sum()),
+        "num_terms": len(vocab),
+        "num_postings": int(offsets[-1]),
+    }
+    # meta.json is written last; its presence marks a complete segment
+    with open(out_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+# ------------------------------------
+# Manifest
+# ------------------------------------
+def read_current(index_path: str = INDEX_PATH):
+    """Return the live manifest file name, or None if no index exists."""
+    try:
+        return (Path(index_path) / "CURRENT").read_text(encoding="utf-8").strip() or None
+    except OSError:
+        return None
+
+def read_manifest(index_path: str = INDEX_PATH):
+    """Return the live manifest, or None if missing or written by an older layout."""
+    # A concurrent publish may remove the manifest between reading CURRENT and
+    # opening it; re-read the pointer a few times before giving up
+    for _ in range(5):
+        name = read_current(index_path)
+        if not name:
+            return None
+        try:
+            with open(Path(index_path) / name, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            break
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError):
+            return None
+    else:
+        return None
+    return manifest if manifest.get("version") == INDEX_VERSION else None
+
+def empty_manifest():
+    """Manifest for an index with no segments."""
+    return {
+        "version": INDEX_VERSION,
+        "generation": 0,
+        "next_segment": 1,
+        "k1": K1,
+        "b": B,
+        "delta": DELTA,
+        "segments": [],
     }
 
-    # Ensure destination exists and persist as JSON
-    Path(INDEX_PATH).parent.mkdir(parents=True, exist_ok=True)
-    with open(INDEX_PATH, "w", encoding="utf-8") as f:
-        json.dump(index, f)
+def publish_manifest(index_path, manifest):
+    """Write `manifest` as the next generation and atomically swap `CURRENT`.
+
+    Files no longer referenced (older manifests, merged or replaced segments)
+    are removed best-effort: on POSIX, readers that still have them mapped
+    keep working; on Windows, mapped files cannot be deleted and are left
+    behind for a later publish to clean up. Returns the published manifest.
+    """
+    root = Path(index_path)
+    manifest = dict(manifest, generation=manifest["generation"] + 1)
+    name = f"manifest-{manifest['generation']:06d}.json"
+    with open(root / f"{name}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(root / f"{name}.tmp", root / name)
+
+    tmp_pointer = root / "CURRENT.tmp"
+    tmp_pointer.write_text(name, encoding="utf-8")
+    os.replace(tmp_pointer, root / "CURRENT")
+
+    live = {seg["name"] for seg in manifest["segments"]}
+    for old in root.glob("manifest-*.json"):
+        if old.name != name:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+    for old in (root / "segments").glob("seg-*"):
+        if old.name not in live:
+            shutil.rmtree(old, ignore_errors=True)
+    # Single-generation layouts from older versions are replaced wholesale
+    for old in root.glob("gen-*"):
+        shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+@contextmanager
+def writer_lock(index_path: str = INDEX_PATH, timeout: float = 600.0):
+    """Serialize index writers across processes with an exclusive lock file."""
+    root = Path(index_path)
+    root.mkdir(parents=True, exist_ok=True)
+    lock_path = root / "LOCK"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"BM25 index is locked by another writer ({lock_path})")
+            time.sleep(0.1)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        yield
+    finally:
+        os.close(fd)
+        os.unlink(lock_path)
+
+def _new_segment(index_path, manifest, ids, documents, metadatas):
+    """Write a segment for the documents and return its manifest entry."""
+    name = f"seg-{manifest['next_segment']:06d}"
+    manifest["next_segment"] += 1
+    meta = write_segment(Path(index_path) / "segments" / name, ids, documents, metadatas)
+    return {
+        "name": name,
+        "N": meta["N"],
+        "total_len": meta["total_len"],
+        "num_terms": meta["num_terms"],
+        "deleted": [],
+        "deleted_len": 0,
+    }
+
+def merge_segments(out_dir, inputs):
+    """Merge segments into one new segment at `out_dir`, dropping deleted docs.
+
+    `inputs` is a list of (segment dir, deleted local ordinals) in the order
+    their documents should appear in the output. Vocabularies are merged
+    k-way, and every output array is filled slice by slice through
+    `open_memmap`, so only the merged vocabulary and per-doc ordinal maps
+    are held in memory. Returns the new segment's `meta.json` contents.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    segs = []
+    N = 0
+    for seg_dir, deleted in inputs:
+        seg_dir = Path(seg_dir)
+        arrays = {
+            name: np.load(seg_dir / f"{name}.npy", mmap_mode="r")
+            for name in ("vocab", "offsets", "doc_ids", "tfs", "doc_len", "ids", "docs_offsets")
+        }
+        live = np.ones(len(arrays["doc_len"]), dtype=bool)
+        live[np.asarray(deleted, dtype=np.int64)] = False
+        # Old local ordinal -> new ordinal in the merged segment (-1 if deleted)
+        remap = np.full(len(live), -1, dtype=np.int32)
+        remap[live] = np.arange(N, N + int(live.sum()), dtype=np.int32)
+        N += int(live.sum())
+        segs.append((seg_dir, arrays, live, remap))
+
+    # Per-document arrays and the text store, copied in input order; text is
+    # read in smaller slices since records are much larger than array rows
+    step = _SLICE // 64
+    id_width = max([a["ids"].dtype.itemsize for _, a, _, _ in segs] + [1])
+    doc_len = open_memmap(out_dir / "doc_len.npy", mode="w+", dtype=np.int32, shape=(N,))
+    ids = open_memmap(out_dir / "ids.npy", mode="w+", dtype=f"S{id_width}", shape=(N,))
+    doc_offsets = open_memmap(out_dir / "docs_offsets.npy", mode="w+", dtype=np.int64, shape=(N + 1,))
+    doc_offsets[0] = 0
+    pos = 0
+    with open(out_dir / "docs.bin", "wb") as store:
+        for seg_dir, a, live, _ in segs:
+            with open(seg_dir / "docs.bin", "rb") as src:
+                for start in range(0, len(live), step):
+                    keep = live[start:start + step]
+                    n = int(keep.sum())
+                    doc_len[pos:pos + n] = a["doc_len"][start:start + step][keep]
+                    ids[pos:pos + n] = a["ids"][start:start + step][keep]
+                    bounds = a["docs_offsets"][start:min(start + step, len(live)) + 1]
+                    src.seek(int(bounds[0]))
+                    block = src.read(int(bounds[-1] - bounds[0]))
+                    lengths = np.diff(bounds)
+                    if n == len(keep):
+                        store.write(block)
+                    else:
+                        rel = bounds - bounds[0]
+                        for j in np.nonzero(keep)[0].tolist():
+                            store.write(block[rel[j]:rel[j + 1]])
+                    doc_offsets[pos + 1:pos + n + 1] = doc_offsets[pos] + np.cumsum(lengths[keep])
+                    pos += n
+
+    # Exact postings count, so the output arrays can be preallocated on disk
+    num_postings = 0
+    for _, a, live, _ in segs:
+        for start in range(0, len(a["doc_ids"]), _SLICE):
+            num_postings += int(live[a["doc_ids"][start:start + _SLICE]].sum())
+    out_ids = open_memmap(out_dir / "doc_ids.npy", mode="w+", dtype=np.int32, shape=(num_postings,))
+    out_tfs = open_memmap(out_dir / "tfs.npy", mode="w+", dtype=np.int32, shape=(num_postings,))
+
+    def terms(i, vocab):
+        for start in range(0, len(vocab), _SLICE):
+            for j, term in enumerate(vocab[start:start + _SLICE].tolist()):
+                yield term, i, start + j
+
+    # k-way merge of the sorted vocabularies; postings of a term are
+    # concatenated in input order, which keeps new ordinals ascending
+    vocab, offsets, max_tf, min_len = [], [0], [], []
+    pos = 0
+    merged_terms = heapq.merge(*(terms(i, a["vocab"]) for i, (_, a, _, _) in enumerate(segs)))
+    for term, group in groupby(merged_terms, key=lambda t: t[0]):
+        start_pos = pos
+        for _, i, term_id in group:
+            a, remap = segs[i][1], segs[i][3]
+            lo, hi = a["offsets"][term_id], a["offsets"][term_id + 1]
+            new = remap[a["doc_ids"][lo:hi]]
+            keep = new >= 0
+            n = int(keep.sum())
+            out_ids[pos:pos + n] = new[keep]
+            out_tfs[pos:pos + n] = a["tfs"][lo:hi][keep]
+            pos += n
+        if pos == start_pos:
+            continue  # every posting of this term was deleted
+        vocab.append(term)
+        offsets.append(pos)
+        max_tf.append(int(out_tfs[start_pos:pos].max()))
+        min_len.append(int(doc_len[out_ids[start_pos:pos]].min()))
+
+    total_len = int(doc_len.sum()) if N else 0
+    for arr in (doc_len, ids, doc_offsets, out_ids, out_tfs):
+        arr.flush()
+    del doc_len, ids, doc_offsets, out_ids, out_tfs
+
+    np.save(out_dir / "vocab.npy", np.array(vocab, dtype=bytes))
+    np.save(out_dir / "offsets.npy", np.array(offsets, dtype=np.int64))
+    np.save(out_dir / "max_tf.npy", np.array(max_tf, dtype=np.int32))
+    np.save(out_dir / "min_len.npy", np.array(min_len, dtype=np.int32))
+
+    meta = {
+        "version": INDEX_VERSION,
+        "N": N,
+        "total_len": total_len,
+        "num_terms": len(vocab),
+        "num_postings": num_postings,
+    }
+    # meta.json is written last; its presence marks a complete segment
+    with open(out_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+def _merge_into_segment(index_path, manifest, entries):
+    """Merge the segments behind manifest `entries` into a new one; return its entry."""
+    name = f"seg-{manifest['next_segment']:06d}"
+    manifest["next_segment"] += 1
+    root = Path(index_path) / "segments"
+    meta = merge_segments(root / name, [(root / e["name"], e["deleted"]) for e in entries])
+    return {
+        "name": name,
+        "N": meta["N"],
+        "total_len": meta["total_len"],
+        "num_terms": meta["num_terms"],
+        "deleted": [],
+        "deleted_len": 0,
+    }
+
+# ------------------------------------
+# Incremental maintenance
+# ------------------------------------
+def id_lookup(seg_dir):
+    """Return a segment's id -> local ordinal table as (sorted ids, ordinals).
+
+    Built once per segment (one read of `ids.npy` and a sort) and cached, so
+    resolving k ids afterwards costs O(k log N) instead of O(N).
+    """
+    key = str(seg_dir)
+    table = _ID_LOOKUPS.get(key)
+    if table is None:
+        ids = np.load(Path(seg_dir) / "ids.npy")
+        order = np.argsort(ids, kind="stable").astype(np.int32)
+        table = _ID_LOOKUPS[key] = (ids[order], order)
+    return table
+
+def find_ordinals(seg_dir, wanted):
+    """Local ordinals in a segment holding any of the `wanted` ids (utf-8 bytes)."""
+    sorted_ids, order = id_lookup(seg_dir)
+    lo = np.searchsorted(sorted_ids, wanted, side="left")
+    hi = np.searchsorted(sorted_ids, wanted, side="right")
+    return [int(o) for l, h in zip(lo, hi) for o in order[l:h]]
+
+def _tombstone(index_path, manifest, doc_ids):
+    """Mark every live copy of `doc_ids` deleted in `manifest` (in place).
+
+    Returns the number of documents newly deleted.
+    """
+    if not doc_ids or not manifest["segments"]:
+        return 0
+    seg_dirs = [Path(index_path) / "segments" / seg["name"] for seg in manifest["segments"]]
+    # Forget tables of segments that have been merged away
+    for key in set(_ID_LOOKUPS) - {str(d) for d in seg_dirs}:
+        del _ID_LOOKUPS[key]
+    wanted = np.array([i.encode("utf-8") for i in doc_ids], dtype=bytes)
+    removed = 0
+    for seg, seg_dir in zip(manifest["segments"], seg_dirs):
+        fresh = sorted(set(find_ordinals(seg_dir, wanted)) - set(seg["deleted"]))
+        if not fresh:
+            continue
+        doc_len = np.load(seg_dir / "doc_len.npy", mmap_mode="r")
+        seg["deleted"] = sorted(seg["deleted"] + fresh)
+        seg["deleted_len"] += int(doc_len[fresh].sum())
+        removed += len(fresh)
+    return removed
+
+def _maybe_merge(index_path, manifest):
+    """Merge segments in `manifest` (in place) when the merge policy calls for it.
+
+    - A segment with more than `MAX_DELETED_RATIO` of its docs deleted is
+      rewritten without them.
+    - While more than `MAX_SEGMENTS` segments are live, the `MERGE_FACTOR`
+      smallest are merged into one.
+
+    Returns True if the manifest changed.
+    """
+    segments = manifest["segments"]
+    victims = [s for s in segments if s["N"] and len(s["deleted"]) / s["N"] > MAX_DELETED_RATIO]
+    if len(segments) > MAX_SEGMENTS:
+        by_size = sorted(segments, key=lambda s: s["N"] - len(s["deleted"]))
+        for seg in by_size[:max(2, MERGE_FACTOR, len(segments) - MAX_SEGMENTS + 1)]:
+            if seg not in victims:
+                victims.append(seg)
+    if not victims:
+        return False
+
+    # Keep the merged docs in their original relative order
+    victims = [s for s in segments if s in victims]
+    kept = [s for s in segments if s not in victims]
+    merged = _merge_into_segment(index_path, manifest, victims)
+    if merged["N"]:
+        kept.append(merged)
+    manifest["segments"] = kept
+    print(f"[merge] {len(victims)} BM25 segment(s) → {1 if merged['N'] else 0} ({merged['N']} live docs)")
+    return True
+
+def add_documents(ids, documents, metadatas, index_path: str = INDEX_PATH):
+    """Add (or replace) chunks in the lexical index as a new segment.
+
+    Existing copies of the same ids are tombstoned first, so this behaves like
+    an upsert. Returns False (and writes nothing) when no index exists yet;
+    `bm25_query` builds one from Chroma on first use.
+    """
+    with writer_lock(index_path):
+        manifest = read_manifest(index_path)
+        if manifest is None:
+            return False
+        ids = list(ids)
+        _tombstone(index_path, manifest, ids)
+        if ids:
+            manifest["segments"].append(
+                _new_segment(index_path, manifest, ids, list(documents), list(metadatas))
+            )
+        _maybe_merge(index_path, manifest)
+        publish_manifest(index_path, manifest)
+    return True
+
+def delete_documents(ids, index_path: str = INDEX_PATH):
+    """Tombstone chunks by Chroma id. Returns the number of docs deleted."""
+    with writer_lock(index_path):
+        manifest = read_manifest(index_path)
+        if manifest is None:
+            return 0
+        removed = _tombstone(index_path, manifest, list(ids))
+        if removed:
+            _maybe_merge(index_path, manifest)
+            publish_manifest(index_path, manifest)
+    return removed
+
+def index_exists(index_path: str = INDEX_PATH):
+    """True if an index in the current layout exists (so updates can apply)."""
+    return read_manifest(index_path) is not None
+
+# ------------------------------------
+# Full rebuild
+# ------------------------------------
+def build_bm25_index(page_size: int = BUILD_PAGE, fanin: int = MERGE_FANIN):
+    """Build and persist a binary BM25 index from the `docs` collection.
+
+    Pages through Chroma `page_size` chunks at a time; each page is written
+    as a sorted run (a temporary segment). Runs are then merged `fanin` at a
+    time until one segment remains, and a manifest containing only that
+    segment is published so running readers pick it up. Peak memory is
+    bounded by one page plus the merged vocabulary, not the corpus.
+    """
+    client = chromadb.PersistentClient(path=CHROMA_DIR)
+    col = client.get_or_create_collection(name="docs")
+    page_size = max(1, page_size)
+    fanin = max(2, fanin)
+
+    with writer_lock(INDEX_PATH):
+        previous = read_manifest(INDEX_PATH)
+        manifest = empty_manifest()
+        if previous:
+            # Keep numbering monotonic so new names never reuse live files
+            manifest["generation"] = previous["generation"]
+            manifest["next_segment"] = previous["next_segment"]
+
+        # Spill one sorted run per page of stored chunks
+        runs = []
+        offset = 0
+        while True:
+            page = col.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            runs.append(_new_segment(INDEX_PATH, manifest, page["ids"], page["documents"], page["metadatas"]))
+            offset += len(page["ids"])
+            if len(runs) > 1:
+                print(f"[run] {offset} chunks spilled in {len(runs)} runs")
+            if len(page["ids"]) < page_size:
+                break
+        if not runs:
+            runs.append(_new_segment(INDEX_PATH, manifest, [], [], []))
+
+        # Merge runs in passes of `fanin` until a single segment remains
+        while len(runs) > 1:
+            merged = [_merge_into_segment(INDEX_PATH, manifest, runs[i:i + fanin]) for i in range(0, len(runs), fanin)]
+            for run in runs:
+                shutil.rmtree(Path(INDEX_PATH) / "segments" / run["name"], ignore_errors=True)
+            runs = merged
+        seg = runs[0]
+        manifest["segments"] = [seg]
+        publish_manifest(INDEX_PATH, manifest)
 
-    print(f"[✓] BM25 index saved to {INDEX_PATH} with {N} references.")
+    print(
+        f"[✓] BM25 index saved to {INDEX_PATH}/segments/{seg['name']} with {seg['N']} references "
+        f"and {seg['num_terms']} terms."
+    )
 
 if __name__ == "__main__":
     build_bm25_index()
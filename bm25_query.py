@@ -1,27 +1,236 @@
 """Lightweight BM25/BM25+ querying utilities.
 
-This module loads a prebuilt BM25 index (JSON) and provides helpers to
-tokenize queries, score documents using a BM25-style function, and return the
-top matches. If the index file is missing, it attempts to build it on the fly
-by calling `bm25_index.build_bm25_index()`.
+This module opens the segmented inverted index written by `bm25_index.py` and
+provides helpers to tokenize queries, score documents over the postings lists
+of the query terms, and return the top matches. Top-k retrieval uses MaxScore
+dynamic pruning over the per-segment postings: the postings of common terms
+are only probed for documents that can still enter the top-k, and short or
+single-term queries fall back to exhaustive vectorized scoring (see
+`bench_bm25.py` for the comparison). If the index is
+missing, it attempts to build it on the fly by calling
+`bm25_index.build_bm25_index()`.
+
+All segment arrays and text stores are memory-mapped read-only, so startup
+only touches a few bytes and multiple worker processes share the same pages
+through the OS cache. Corpus statistics (N, avgdl, IDF) are computed over the
+live (non-tombstoned) documents of all segments, so scores match a fresh
+single-segment build. The opened index is kept resident and shared by every
+caller in the process; it is only reopened when the `CURRENT` manifest
+pointer changes.
 
 Environment:
-- `BM25_INDEX_PATH` (optional): path to the JSON index. Defaults to
-  `./data/bm25_index.json`.
+- `BM25_INDEX_PATH` (optional): path to the index directory. Defaults to
+  `./data/bm25_index`.
+- `BM25_PRUNE_MIN_POSTINGS` (optional): total postings below which queries
+  are scored exhaustively instead of with MaxScore. Defaults to `20000`.
 """
 
 import json
-import os
 import math
+import mmap
+import os
+import threading
+from bisect import bisect_right
 from collections import Counter
 from pathlib import Path
 
+import numpy as np
 from dotenv import load_dotenv
 
+import tracing
+
 load_dotenv()
-# Location of the serialized BM25 index built by `bm25_index.py`.
+# Location of the BM25 index directory built by `bm25_index.py`.
 # This can be overridden via the BM25_INDEX_PATH environment variable.
-INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./data/bm25_index.json")
+INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./data/bm25_index")
+
+# Process-wide cache of the opened index: {"key": (path, ino, mtime_ns), "index": BM25Index}
+_INDEX_CACHE = {"key": None, "index": None}
+_INDEX_LOCK = threading.Lock()
+
+# Below this many postings in total, exhaustive vectorized scoring is faster than pruning
+PRUNE_MIN_POSTINGS = int(os.getenv("BM25_PRUNE_MIN_POSTINGS", "20000"))
+
+class Segment:
+    """Read-only, memory-mapped view of one immutable segment directory.
+
+    Attributes mirror the files written by `bm25_index.write_segment`:
+    `vocab`, `offsets`, `doc_ids`, `tfs`, `max_tf`, `min_len`, `doc_len`,
+    `ids` are numpy arrays backed by mmaps. `live` is a boolean mask over
+    local ordinals, or None when nothing in the segment is deleted.
+    """
+
+    def __init__(self, seg_dir, deleted=()):
+        self.seg_dir = Path(seg_dir)
+        with open(self.seg_dir / "meta.json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.N = self.meta["N"]
+
+        def load(name):
+            return np.load(self.seg_dir / f"{name}.npy", mmap_mode="r")
+
+        self.vocab = load("vocab")
+        self.offsets = load("offsets")
+        self.doc_ids = load("doc_ids")
+        self.tfs = load("tfs")
+        self.max_tf = load("max_tf")
+        self.min_len = load("min_len")
+        self.doc_len = load("doc_len")
+        self.docs_offsets = load("docs_offsets")
+        self.ids = load("ids")
+
+        self.live = None
+        if len(deleted):
+            self.live = np.ones(self.N, dtype=bool)
+            self.live[np.asarray(deleted, dtype=np.int64)] = False
+
+        # Text store: mmap the whole file; an empty file cannot be mapped
+        self._store = None
+        if self.docs_offsets[-1] > 0:
+            with open(self.seg_dir / "docs.bin", "rb") as f:
+                self._store = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def term_id(self, term):
+        """Return the vocabulary position of `term`, or None if unseen."""
+        key = term.encode("utf-8")
+        pos = int(np.searchsorted(self.vocab, key))
+        if pos < len(self.vocab) and self.vocab[pos] == key:
+            return pos
+        return None
+
+    def record(self, ordinal):
+        """Decode the stored {id, text, meta} record for a local doc ordinal."""
+        start, end = self.docs_offsets[ordinal], self.docs_offsets[ordinal + 1]
+        return json.loads(self._store[start:end])
+
+class BM25Index:
+    """Read-only view over every live segment listed in one manifest.
+
+    Segments are laid end to end in a single dense ordinal space: a document's
+    global ordinal is its segment's `base` plus its local ordinal. Tombstoned
+    documents keep their ordinal but are filtered out of every postings list.
+    `N`, `avgdl`, `k1`, `b`, `delta` describe the live corpus. Length norms
+    depend on the live avgdl, so they are computed per query from the mmap'd
+    `doc_len` of the postings touched (`norm`) rather than materialized per
+    manifest; opening an index copies nothing proportional to N.
+
+    Documents are addressed internally by dense integer ordinals; hits are
+    materialized by direct array indexing (`record`). Chunk ids are only
+    resolved to ordinals by the writer (`bm25_index.id_lookup`).
+    """
+
+    def __init__(self, root, manifest):
+        self.root = Path(root)
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self.generation = manifest["generation"]
+        self.k1 = manifest["k1"]
+        self.b = manifest["b"]
+        self.delta = manifest["delta"]
+
+        self.segments = []
+        self.bases = []
+        base = 0
+        for entry in manifest["segments"]:
+            self.segments.append(Segment(self.root / "segments" / entry["name"], entry["deleted"]))
+            self.bases.append(base)
+            base += entry["N"]
+        self.size = base  # one past the largest global ordinal
+
+        self.N = sum(e["N"] - len(e["deleted"]) for e in manifest["segments"])
+        total_len = sum(e["total_len"] - e["deleted_len"] for e in manifest["segments"])
+        self.avgdl = total_len / self.N if self.N else 0.0
+
+    def term_postings(self, term):
+        """Return per-segment postings views and bounds for `term`.
+
+        Returns None if no live document contains the term, otherwise
+        (views, df, max_tf, min_len): `views[i]` is None or the
+        (doc_ids, tfs) slices of segment i's mmap'd arrays (local ordinals
+        in ascending order, tombstones included), `df` is the live document
+        frequency, and `max_tf`/`min_len` are bounds for `upper_bound` (taken
+        over whole segments, so they stay valid when some postings are
+        deleted). Nothing is copied except for counting the live postings of
+        segments that have tombstones.
+        """
+        views, df = [], 0
+        max_tf, min_len = 0, None
+        for seg in self.segments:
+            term_id = seg.term_id(term)
+            if term_id is None:
+                views.append(None)
+                continue
+            start, end = seg.offsets[term_id], seg.offsets[term_id + 1]
+            ords, tfs = seg.doc_ids[start:end], seg.tfs[start:end]
+            live = len(ords) if seg.live is None else int(np.count_nonzero(seg.live[ords]))
+            if not live:
+                views.append(None)
+                continue
+            views.append((ords, tfs))
+            df += live
+            max_tf = max(max_tf, int(seg.max_tf[term_id]))
+            seg_min = int(seg.min_len[term_id])
+            min_len = seg_min if min_len is None else min(min_len, seg_min)
+        if not df:
+            return None
+        return views, df, max_tf, min_len
+
+    def postings(self, term):
+        """Return live postings for `term` across all segments, concatenated.
+
+        Returns None if no live document contains the term, otherwise
+        (ordinals, tfs, norms, df): global ordinals in ascending order with
+        their term frequencies and length norms, and the live document
+        frequency.
+        """
+        hit = self.term_postings(term)
+        if hit is None:
+            return None
+        views, df, _, _ = hit
+        all_ords, all_tfs, all_norms = [], [], []
+        for seg, base, view in zip(self.segments, self.bases, views):
+            if view is None:
+                continue
+            ords, tfs = view
+            if seg.live is not None:
+                keep = seg.live[ords]
+                ords, tfs = ords[keep], tfs[keep]
+            all_ords.append(ords.astype(np.int64) + base)
+            all_tfs.append(tfs)
+            all_norms.append(self.norm(seg, ords))
+        return np.concatenate(all_ords), np.concatenate(all_tfs), np.concatenate(all_norms), df
+
+    def norm(self, seg, local):
+        """k1 * (1 - b + b * doc_len / avgdl) for local ordinals of `seg`."""
+        return self.k1 * (1 - self.b + self.b * seg.doc_len[local] / (self.avgdl or 1.0))
+
+    def idf(self, df):
+        """Inverse document frequency with standard BM25 smoothing."""
+        return math.log(1 + (self.N - df + 0.5) / (df + 0.5))
+
+    def upper_bound(self, max_tf, min_len):
+        """Largest BM25+ contribution (before IDF) any doc can get from a term.
+
+        The contribution shrinks with doc length and is monotonic in tf (it
+        grows with tf unless norm < delta, where BM25+ makes it shrink), so
+        the term's shortest doc combined with the better of tf=1 and its max
+        tf bounds every posting.
+        """
+        norm = self.k1 * (1 - self.b + self.b * float(min_len) / (self.avgdl or 1.0))
+        return max(
+            (f + self.delta) * (self.k1 + 1) / (f + norm)
+            for f in (1.0, float(max_tf))
+        )
+
+    def _locate(self, ordinal):
+        """Return (segment, local ordinal) for a global ordinal."""
+        i = bisect_right(self.bases, ordinal) - 1
+        return self.segments[i], ordinal - self.bases[i]
+
+    def record(self, ordinal):
+        """Decode the stored {id, text, meta} record for a doc ordinal."""
+        seg, local = self._locate(ordinal)
+        return seg.record(local)
 
 def tokenize(text):
     """Tokenize a string into simple alphanumeric, lowercased tokens.
@@ -36,44 +245,237 @@ def tokenize(text):
     """
     return [w.lower() for w in text.split() if w.isalnum() and len(w) > 2]
 
-def score_bm25(query_tokens, tf, df, doc_len, avgdl, N, k1=1.5, b=0.75, delta=1.0):
-    """Compute BM25/BM25+ scores for a set of documents.
+def score_bm25(query_tokens, index):
+    """Compute BM25/BM25+ scores term-at-a-time over postings lists.
 
     Parameters
     - query_tokens: list of pre-tokenized query terms
-    - tf: dict mapping doc_id -> {term -> term frequency in doc}
-    - df: dict mapping term -> document frequency across the corpus
-    - doc_len: dict mapping doc_id -> document length (token count)
-    - avgdl: average document length across the corpus
-    - N: total number of documents in the corpus
-    - k1, b: standard BM25 hyperparameters
-    - delta: additive term for BM25+ to reduce the length normalization bias
+    - index: an opened `BM25Index`
 
     Returns
-    - dict mapping doc_id -> score
+    - (ordinals, scores): numpy arrays of the matching doc ordinals and their
+      scores (unsorted)
 
     Notes
-    - IDF uses log(1 + (N - df + 0.5)/(df + 0.5)) to avoid negative values.
+    - Only documents that contain at least one query term are touched, so the
+      cost is proportional to the postings lengths, not the corpus size.
     - The normalization applies BM25+ by using (f + delta) in the numerator.
+      Classic BM25 would be f * (k1 + 1) / (f + norm).
+    """
+    all_ords, all_contrib = [], []
+    # Repeated query terms contribute once per occurrence
+    for term, qtf in Counter(query_tokens).items():
+        hit = index.postings(term)
+        if hit is None:
+            continue
+        ords, tfs, norms, df = hit
+        f = tfs.astype(np.float64)
+        weight = qtf * index.idf(df) * (index.k1 + 1)
+        # BM25+ normalization: use (f + delta) to lessen length bias
+        all_ords.append(ords)
+        all_contrib.append(weight * (f + index.delta) / (f + norms))
+
+    if not all_ords:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    # Sum contributions per document across the query terms
+    ordinals, inverse = np.unique(np.concatenate(all_ords), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(all_contrib))
+    return ordinals, scores
+
+def _contributions(index, weight, seg, local, tfs):
+    """BM25+ contributions of one term for local ordinals of `seg` (idf-weighted)."""
+    f = tfs.astype(np.float64)
+    return weight * (f + index.delta) * (index.k1 + 1) / (f + index.norm(seg, local))
+
+def _probe(doc_ids, candidates):
+    """Binary-search sorted `candidates` in a postings view: (positions, found mask)."""
+    pos = np.searchsorted(doc_ids, candidates)
+    found = np.zeros(len(candidates), dtype=bool)
+    inside = pos < len(doc_ids)
+    found[inside] = doc_ids[pos[inside]] == candidates[inside]
+    return pos, found
+
+def _top_k_exhaustive(query_tokens, index, top_k):
+    """Top-k of the exhaustive `score_bm25`, ties broken by lower ordinal."""
+    ordinals, scores = score_bm25(query_tokens, index)
+    if len(scores) > top_k:
+        keep = np.argpartition(-scores, top_k - 1)[:top_k]
+        # Keep every doc tied with the k-th score so ordinals break the tie
+        keep = np.flatnonzero(scores >= scores[keep].min())
+        ordinals, scores = ordinals[keep], scores[keep]
+    order = np.lexsort((ordinals, -scores))[:top_k]
+    return [(int(o), float(s)) for o, s in zip(ordinals[order], scores[order])]
+
+def top_k_bm25(query_tokens, index, top_k):
+    """Return the top-k (ordinal, score) pairs using MaxScore pruning.
+
+    Parameters
+    - query_tokens: list of pre-tokenized query terms
+    - index: an opened `BM25Index`
+    - top_k: number of results to keep
+
+    Algorithm (term-at-a-time MaxScore, vectorized per segment)
+    - Each query term gets an upper bound (idf * max contribution) and terms
+      are visited from the highest bound (rarest) down. The docs of the
+      current term that no higher-bound term contains are the candidates;
+      docs shared with a higher-bound term were already scored.
+    - Each candidate is completed by binary-searching the lower-bound terms'
+      mmap'd postings, highest bound first. Before every probe, candidates
+      whose partial score plus the remaining bounds cannot reach the k-th
+      best score (the threshold) are dropped, so contributions are only
+      computed for docs still in the running.
+    - Once the summed bounds of the remaining terms fall below the
+      threshold, no unseen doc can enter the top-k and the long postings of
+      common terms are never scanned, only probed for the survivors.
+
+    Single-term queries and queries whose postings total fewer than
+    `PRUNE_MIN_POSTINGS` entries use the vectorized exhaustive `score_bm25`,
+    which is faster when there is little to skip.
+
+    Returns a list of (ordinal, score) sorted by descending score (ties by
+    ascending ordinal), matching the ranking of the exhaustive `score_bm25`.
+    """
+    if top_k <= 0:
+        return []
+
+    terms = []
+    total = 0
+    for term, qtf in Counter(query_tokens).items():
+        hit = index.term_postings(term)
+        if hit is None:
+            continue
+        views, df, max_tf, min_len = hit
+        weight = qtf * index.idf(df)
+        # Small slack keeps the bound safe against float rounding
+        ub = weight * index.upper_bound(max_tf, min_len) * (1 + 1e-6)
+        terms.append((ub, weight, views))
+        total += df
+    if not terms:
+        return []
+    if len(terms) == 1 or total < PRUNE_MIN_POSTINGS:
+        return _top_k_exhaustive(query_tokens, index, top_k)
+
+    # Ascending upper bounds; prefix[i] = sum of bounds of terms[0..i-1]
+    terms.sort(key=lambda t: t[0])
+    prefix = [0.0]
+    for ub, _, _ in terms:
+        prefix.append(prefix[-1] + ub)
+
+    best_ords = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float64)
+    threshold = 0.0  # k-th best score so far (0 until k docs are scored)
+
+    for j in range(len(terms) - 1, -1, -1):
+        if prefix[j + 1] < threshold:
+            break  # docs outside terms j+1.. score at most prefix[j + 1]
+        _, weight, views = terms[j]
+        for s, (seg, base) in enumerate(zip(index.segments, index.bases)):
+            if views[s] is None:
+                continue
+            cand, tfs = np.asarray(views[s][0]), np.asarray(views[s][1])
+            if seg.live is not None:
+                keep = seg.live[cand]
+                cand, tfs = cand[keep], tfs[keep]
+            # Docs containing a higher-bound term were scored with that term
+            for k in range(j + 1, len(terms)):
+                higher = terms[k][2][s]
+                if higher is not None and len(cand):
+                    _, found = _probe(higher[0], cand)
+                    cand, tfs = cand[~found], tfs[~found]
+            if not len(cand):
+                continue
+            score = _contributions(index, weight, seg, cand, tfs)
+
+            # Complete with lower-bound terms, dropping hopeless docs first
+            for i in range(j - 1, -1, -1):
+                alive = score + prefix[i + 1] >= threshold
+                if not alive.all():
+                    cand, score = cand[alive], score[alive]
+                    if not len(cand):
+                        break
+                lower = terms[i][2][s]
+                if lower is None:
+                    continue
+                pos, found = _probe(lower[0], cand)
+                if found.any():
+                    hit_pos = pos[found]
+                    score[found] += _contributions(
+                        index, terms[i][1], seg, cand[found], np.asarray(lower[1][hit_pos])
+                    )
+            alive = score >= threshold
+            if not alive.any():
+                continue
+
+            # Merge into the running top-k (ties keep the lower ordinal)
+            all_ords = np.concatenate([best_ords, cand[alive].astype(np.int64) + base])
+            all_scores = np.concatenate([best_scores, score[alive]])
+            order = np.lexsort((all_ords, -all_scores))[:top_k]
+            best_ords, best_scores = all_ords[order], all_scores[order]
+            if len(best_scores) == top_k:
+                threshold = float(best_scores[-1])
+
+    return [(int(o), float(sc)) for o, sc in zip(best_ords, best_scores)]
+
+def load_index(path: str = INDEX_PATH):
+    """Return the opened BM25 index, reusing the in-memory copy when possible.
+
+    The `CURRENT` pointer is stat'ed on every call (cheap) and the index is only
+    reopened when it changed, so rebuilds and incremental updates by
+    `bm25_index.py` or `ingest.py` are picked up transparently without
+    restarting the app. If no index exists (or it uses an outdated layout),
+    it is built first via `bm25_index.build_bm25_index()`.
+
+    Returns a `BM25Index`, or None if it could not be built or opened.
     """
-    scores = {}
-    for doc_id in tf:
-        score = 0.0
-        for term in query_tokens:
-            if term in tf[doc_id]:
-                f = tf[doc_id][term]
-                df_term = df.get(term, 0)
-                # Inverse document frequency with standard BM25 smoothing
-                idf = math.log(1 + (N - df_term + 0.5) / (df_term + 0.5))
-                # Classic BM25 (without +) shown below for reference:
-                # norm = f * (k1 + 1) / (f + k1 * (1 - b + b * doc_len[doc_id] / avgdl))
-                # BM25+ normalization: use (f + delta) to lessen length bias
-                norm = (f + delta) * (k1 + 1) / (f + k1 * (1 - b + b * doc_len[doc_id] / avgdl))
-                score += idf * norm
-        # Only store non-zero scores to keep result sparse
-        if score > 0:
-            scores[doc_id] = score
-    return scores
+    from bm25_index import build_bm25_index, read_manifest  # import the indexer
+
+    pointer = Path(path) / "CURRENT"
+    with _INDEX_LOCK:
+        # If the BM25 index doesn't exist, build it automatically
+        if not pointer.exists():
+            print(f"[!] BM25 index not found at {path}")
+            print("[→] Building new BM25 index from Chroma documents...")
+            try:
+                build_bm25_index()
+            except Exception as e:
+                print(f"[error] Failed to build BM25 index: {e}")
+                return None
+
+        try:
+            st = os.stat(pointer)
+        except OSError as e:
+            print(f"[error] Failed to read BM25 index: {e}")
+            return None
+        key = (path, st.st_ino, st.st_mtime_ns)
+
+        # Fast path: manifest unchanged since the last open
+        if _INDEX_CACHE["key"] == key:
+            return _INDEX_CACHE["index"]
+
+        # Indexes written by an older bm25_index.py use another layout; rebuild once
+        manifest = read_manifest(path)
+        if manifest is None:
+            print(f"[!] BM25 index at {path} uses an outdated layout")
+            print("[→] Rebuilding BM25 index from Chroma documents...")
+            try:
+                build_bm25_index()
+                st = os.stat(pointer)
+                key = (path, st.st_ino, st.st_mtime_ns)
+                manifest = read_manifest(path)
+            except Exception as e:
+                print(f"[error] Failed to rebuild BM25 index: {e}")
+                return None
+
+        # Open the segments of the freshly created (or changed) manifest
+        try:
+            index = BM25Index(path, manifest)
+        except Exception as e:
+            print(f"[error] Failed to read BM25 index: {e}")
+            return None
+
+        _INDEX_CACHE["key"] = key
+        _INDEX_CACHE["index"] = index
+        return index
 
 def query_bm25(query: str, top_k: int = 5):
     """Query the BM25 index and return top-k matches.
@@ -83,56 +485,24 @@ def query_bm25(query: str, top_k: int = 5):
     - top_k: number of results to return
 
     Behavior
-    - If the index JSON at `INDEX_PATH` is missing, attempts to build it by
-      calling `bm25_index.build_bm25_index()`.
-    - Loads index components and computes BM25 scores for documents.
+    - Obtains the resident index via `load_index()` (built on first use if
+      missing, reopened only when the manifest changes).
+    - Ranks documents with the MaxScore top-k scorer (`top_k_bm25`).
     - Returns a list of tuples: (text, meta, score), sorted by score desc.
     """
-    from pathlib import Path
-    import json
-    from bm25_index import build_bm25_index  # import the indexer
-
-    # If the BM25 index file doesn't exist, build it automatically
-    if not Path(INDEX_PATH).exists():
-        print(f"[!] BM25 index not found at {INDEX_PATH}")
-        print("[→] Building new BM25 index from Chroma documents...")
-        try:
-            build_bm25_index()
-        except Exception as e:
-            print(f"[error] Failed to build BM25 index: {e}")
+    with tracing.span("query_bm25", top_k=top_k) as sp:
+        with tracing.span("load_index"):
+            index = load_index()
+        if index is None:
             return []
 
-    # Load the freshly created (or preexisting) index
-    try:
-        with open(INDEX_PATH, "r", encoding="utf-8") as f:
-            index = json.load(f)
-    except Exception as e:
-        print(f"[error] Failed to read BM25 index: {e}")
-        return []
-
-    # Unpack serialized index components
-    tf = index["tf"]
-    df = index["df"]
-    doc_len = index["doc_len"]
-    avgdl = index["avgdl"]
-    N = index["N"]
-    ids = index["ids"]
-    texts = index["texts"]
-    metas = index["metas"]
-
-    # Score documents and rank by descending score
-    query_tokens = tokenize(query)
-    scores = score_bm25(query_tokens, tf, df, doc_len, avgdl, N)
-
-    top_hits = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
-    results = []
-    for doc_id, score in top_hits:
-        try:
-            # Map the string doc_id back to its text and metadata
-            # Note: linear search; could be optimized by a reverse map.
-            idx = ids.index(doc_id)
-            results.append((texts[idx], metas[idx], score))
-        except ValueError:
-            continue  # skip missing doc_id if index mismatch
+        # Score documents (by ordinal) with pruning; only the top-k are kept
+        query_tokens = tokenize(query)
+        top_hits = top_k_bm25(query_tokens, index, top_k)
 
+        results = []
+        for ordinal, score in top_hits:
+            record = index.record(ordinal)
+            results.append((record["text"], record["meta"], score))
+        sp.set(terms=len(query_tokens), hits=len(results), docs=index.N, segments=len(index.segments))
     return results
@@ -0,0 +1,96 @@
+"""Token-budget-aware packing of retrieved chunks into prompt context.
+
+Prompt-eval time on Ollama grows with prompt length, and a hard character
+cut can slice a chunk mid-sentence. The packer instead:
+
+- estimates the tokens of each labeled chunk (a cheap chars-per-token
+  heuristic; Ollama exposes no tokenizer endpoint),
+- fills `CONTEXT_TOKENS` greedily in score order,
+- trims the chunk that no longer fits at a sentence boundary (if at least
+  `MIN_CHUNK_TOKENS` of it fit), and drops lower-value chunks that don't.
+
+`pack_context` returns the packed blocks plus counts, so callers can report
+the prompt size they are about to send.
+
+Environment variables:
+- `CONTEXT_TOKENS`   (default: `2000`) — token budget for the context section
+- `CHARS_PER_TOKEN`  (default: `4.0`) — estimate used for token counts
+- `MIN_CHUNK_TOKENS` (default: `40`) — smallest trimmed chunk worth keeping
+"""
+
+import math
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "2000"))
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4.0"))
+MIN_CHUNK_TOKENS = int(os.getenv("MIN_CHUNK_TOKENS", "40"))
+
+# Sentence ends: terminal punctuation followed by whitespace
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of `text` (ceil of chars / `CHARS_PER_TOKEN`)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+def split_sentences(text: str):
+    """Split text into sentences at terminal punctuation."""
+    return [s for s in _SENTENCE_END.split(text.strip()) if s]
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of whole sentences of `text` within `max_tokens` ('' if none fit)."""
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        cost = estimate_tokens(sentence + " ")
+        if used + cost > max_tokens:
+            break
+        kept.append(sentence)
+        used += cost
+    return " ".join(kept)
+
+def pack_context(blocks, budget: int = CONTEXT_TOKENS, min_chunk_tokens: int = MIN_CHUNK_TOKENS):
+    """Pack (label, text) blocks, best first, into a token budget.
+
+    Each kept block is rendered as "[i] label\\ntext"; blocks are separated by
+    blank lines. A block that does not fit whole is trimmed at a sentence
+    boundary when at least `min_chunk_tokens` of it fit, otherwise dropped;
+    packing continues with the next block, so a short lower-ranked chunk can
+    still use leftover budget.
+
+    Returns (kept, stats): `kept` is a list of (label, text) in input order,
+    `stats` has `context_tokens`, `chunks_used`, `chunks_trimmed` and
+    `chunks_dropped`.
+    """
+    kept, used, trimmed, dropped = [], 0, 0, 0
+    for label, text in blocks:
+        # Header "[i] label\n" plus the blank-line separator count against the budget
+        overhead = estimate_tokens(f"[{len(kept) + 1}] {label}\n\n\n")
+        remaining = budget - used - overhead
+        cost = estimate_tokens(text)
+        if cost > remaining:
+            if remaining < min_chunk_tokens:
+                dropped += 1
+                continue
+            text = trim_to_tokens(text, remaining)
+            if estimate_tokens(text) < min_chunk_tokens:
+                dropped += 1
+                continue
+            cost = estimate_tokens(text)
+            trimmed += 1
+        kept.append((label, text))
+        used += overhead + cost
+
+    stats = {
+        "context_tokens": used,
+        "chunks_used": len(kept),
+        "chunks_trimmed": trimmed,
+        "chunks_dropped": dropped,
+    }
+    return kept, stats
+
+def render_context(kept) -> str:
+    """Render packed (label, text) blocks as numbered context sections."""
+    return "\n\n".join(f"[{i}] {label}\n{text}" for i, (label, text) in enumerate(kept, 1))
@@ -0,0 +1,142 @@
+"""Persistent on-disk cache for Ollama embeddings.
+
+Embeddings are keyed by sha256(model name + normalized text) and stored as
+compact float16 (or float32) blobs in a small SQLite file, so ingest re-runs
+after chunking tweaks and repeated user questions skip the embedding round
+trip. The cache is bounded in size: when it grows past `EMBED_CACHE_MAX_MB`,
+the least recently used entries are evicted.
+
+SQLite handles locking, so several processes (ingest, uvicorn workers) can
+share one cache file.
+
+Environment variables:
+- `EMBED_CACHE`        (default: `true`) — enable the cache
+- `EMBED_CACHE_PATH`   (default: `./data/embed_cache.sqlite3`) — cache file
+- `EMBED_CACHE_MAX_MB` (default: `512`) — size bound before LRU eviction
+- `EMBED_CACHE_DTYPE`  (default: `float16`) — `float16` or `float32`
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+EMBED_CACHE = os.getenv("EMBED_CACHE", "true").lower() == "true"
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./data/embed_cache.sqlite3")
+EMBED_CACHE_MAX_MB = float(os.getenv("EMBED_CACHE_MAX_MB", "512"))
+EMBED_CACHE_DTYPE = os.getenv("EMBED_CACHE_DTYPE", "float16")
+
+def normalize_text(text: str) -> str:
+    """Collapse runs of whitespace so trivially different copies share a key."""
+    return " ".join(text.split())
+
+def cache_key(model: str, text: str) -> str:
+    """Cache key for one (model, text) pair."""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Size-bounded LRU map from (model, text) to an embedding vector."""
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, max_mb: float = EMBED_CACHE_MAX_MB,
+                 dtype: str = EMBED_CACHE_DTYPE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, dtype TEXT NOT NULL, vec BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        # Running size estimate; the exact SUM is only recomputed when it trips the bound
+        self._approx_bytes = self._total_bytes()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model: str, texts):
+        """Return a list aligned with `texts`: cached vectors (lists) or None."""
+        keys = [cache_key(model, t) for t in texts]
+        found = {}
+        with self._lock:
+            # SQLite caps bound parameters; look keys up in slices
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model: str, texts, vectors):
+        """Store vectors for `texts`, then evict LRU entries if over budget."""
+        now = time.time()
+        rows = [
+            (cache_key(model, t), self.dtype.name, np.asarray(v, dtype=self.dtype).tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dtype, vec, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._approx_bytes += sum(len(r[2]) for r in rows)
+            if self._approx_bytes > self.max_bytes:
+                self._evict()
+
+    def _total_bytes(self):
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings").fetchone()[0]
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is under 90% of its bound."""
+        total = self._total_bytes()
+        self._approx_bytes = total
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, LENGTH(vec) FROM embeddings ORDER BY last_used"):
+            if total - freed <= target:
+                break
+            doomed.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+        self._conn.commit()
+        self._approx_bytes = total - freed
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_cache():
+    """Return the process-wide cache, or None when `EMBED_CACHE` is disabled."""
+    global _CACHE
+    if not EMBED_CACHE:
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = EmbeddingCache()
+    return _CACHE
@@ -0,0 +1,64 @@
+"""Ollama embedding helper.
+
+Calls Ollama's batch `/api/embed` endpoint directly, so callers can embed many
+chunks per request and hand precomputed vectors to Chroma. This is the same
+endpoint Chroma's `OllamaEmbeddingFunction` uses, so vectors are
+interchangeable with ones embedded through the collection.
+
+Requests share the pooled, retrying session from `ollama_client.py`.
+
+Lookups go through the persistent embedding cache (`embed_cache.py`) first,
+so only texts that were never embedded with the current model hit Ollama.
+
+Environment variables:
+- `EMBED_MODEL`     (default: `nomic-embed-text`) — Ollama embed model name
+- `OLLAMA_URL`      (default: `http://localhost:11434`) — Ollama endpoint
+- `EMBED_TIMEOUT`   (default: `120`) — per-request timeout (seconds)
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+import ollama_client
+from embed_cache import get_cache
+
+load_dotenv()
+EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "120"))
+
+def _request_embeddings(texts, model):
+    """One Ollama `/api/embed` call for a list of texts (pooled session)."""
+    r = ollama_client.post(
+        f"{OLLAMA_URL}/api/embed",
+        {"model": model, "input": list(texts)},
+        timeout=EMBED_TIMEOUT,
+    )
+    return r.json()["embeddings"]
+
+def embed_texts(texts, model: str = EMBED_MODEL, use_cache: bool = True):
+    """Embed a list of texts, serving cached vectors and batching the misses.
+
+    Misses are embedded in a single Ollama request and written back to the
+    cache. Returns a list of vectors aligned with `texts`.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    cache = get_cache() if use_cache else None
+    if cache is None:
+        return _request_embeddings(texts, model)
+
+    vectors = cache.get_many(model, texts)
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        fresh = _request_embeddings([texts[i] for i in missing], model)
+        cache.put_many(model, [texts[i] for i in missing], fresh)
+        for i, v in zip(missing, fresh):
+            vectors[i] = v
+    return vectors
+
+def embed_query(text: str, model: str = EMBED_MODEL):
+    """Embed a single query string (cached); returns one vector."""
+    return embed_texts([text], model)[0]
@@ -0,0 +1,128 @@
+"""Rank fusion for hybrid (vector + BM25) retrieval results.
+
+Vector similarities live in [0, 1] while BM25+ scores are unbounded, so
+sorting the raw scores together lets whichever scale is larger dominate. The
+functions here combine per-leg ranked lists into one list on a common [0, 1]
+scale:
+
+- `rrf`: reciprocal rank fusion, sum of w / (k + rank); ignores raw scores.
+- `weighted_sum(..., norm="minmax")`: min-max normalize each leg, weighted sum.
+- `weighted_sum(..., norm="zscore")`: z-score each leg, squash with a logistic,
+  weighted sum.
+
+Input legs map a leg name (e.g. "vector", "bm25") to hits shaped
+(text, meta, score, source) in descending score order. The same chunk found by
+several legs is merged; its `source` becomes e.g. "vector+bm25".
+
+Fused hits are (text, meta, score, source, leg_scores), where `leg_scores`
+maps each leg that found the chunk to its raw score (cosine similarity or
+BM25+). Fused scores only rank hits against each other (with RRF the top hit
+always scores 1.0), so absolute thresholds such as `MIN_SCORE` must be
+applied to the raw leg scores.
+
+Environment variables:
+- `FUSION_METHOD`   (default: `rrf`) — `rrf`, `minmax` or `zscore`
+- `RRF_K`           (default: `60`) — RRF rank damping constant
+- `VECTOR_WEIGHT`   (default: `1.0`) — weight of the vector leg
+- `BM25_WEIGHT`     (default: `1.0`) — weight of the BM25 leg
+- `FUSION_OVERFETCH`(default: `3`) — candidates fetched per leg, as a multiple of top_k
+"""
+
+import math
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+FUSION_METHOD = os.getenv("FUSION_METHOD", "rrf").lower()
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEG_WEIGHTS = {
+    "vector": float(os.getenv("VECTOR_WEIGHT", "1.0")),
+    "bm25": float(os.getenv("BM25_WEIGHT", "1.0")),
+}
+FUSION_OVERFETCH = int(os.getenv("FUSION_OVERFETCH", "3"))
+
+def _chunk_key(hit):
+    """Identity of a chunk across legs: file, page and the chunk text itself."""
+    text, meta = hit[0], hit[1]
+    return (meta.get("source_file"), meta.get("page_number"), text)
+
+def _merge(legs, leg_scores, total_weight):
+    """Sum per-leg normalized scores by chunk and return fused hits, best first.
+
+    Each hit keeps the raw score of every leg that found it (see module
+    docstring).
+
+    `leg_scores[name]` is a list of normalized, already weighted scores
+    aligned with `legs[name]`. The sum is divided by `total_weight` so a chunk
+    that tops every leg scores 1.0.
+    """
+    fused = {}
+    for name, hits in legs.items():
+        for hit, score in zip(hits, leg_scores[name]):
+            key = _chunk_key(hit)
+            if key not in fused:
+                fused[key] = [hit[0], hit[1], 0.0, {}]
+            entry = fused[key]
+            entry[2] += score
+            entry[3][name] = max(hit[2], entry[3].get(name, hit[2]))
+
+    results = [
+        (text, meta, score / total_weight if total_weight else 0.0, "+".join(raw), raw)
+        for text, meta, score, raw in fused.values()
+    ]
+    results.sort(key=lambda x: x[2], reverse=True)
+    return results
+
+def rrf(legs, weights=None, k=RRF_K):
+    """Reciprocal rank fusion: score = sum over legs of w / (k + rank).
+
+    Scores are scaled by the best attainable value (rank 1 in every leg) so
+    they fall in [0, 1].
+    """
+    weights = weights or LEG_WEIGHTS
+    leg_scores = {
+        name: [weights.get(name, 1.0) * (k + 1) / (k + rank) for rank in range(1, len(hits) + 1)]
+        for name, hits in legs.items()
+    }
+    # Only legs that returned hits count, so a dropped leg doesn't cap scores
+    total = sum(weights.get(name, 1.0) for name, hits in legs.items() if hits)
+    return _merge(legs, leg_scores, total)
+
+def _minmax(scores):
+    """Scale scores to [0, 1]; a single (or constant) score maps to 1.0."""
+    lo, hi = min(scores), max(scores)
+    if hi == lo:
+        return [1.0 for _ in scores]
+    return [(s - lo) / (hi - lo) for s in scores]
+
+def _zscore(scores):
+    """Standardize scores and squash with a logistic so they fall in (0, 1)."""
+    mean = sum(scores) / len(scores)
+    std = math.sqrt(sum((s - mean) ** 2 for s in scores) / len(scores))
+    if std == 0:
+        return [0.5 for _ in scores]
+    return [1.0 / (1.0 + math.exp(-(s - mean) / std)) for s in scores]
+
+def weighted_sum(legs, weights=None, norm="minmax"):
+    """Normalize each leg's raw scores (`minmax` or `zscore`) and sum with weights.
+
+    A chunk missing from a leg contributes 0 for that leg.
+    """
+    weights = weights or LEG_WEIGHTS
+    normalize = _zscore if norm == "zscore" else _minmax
+    leg_scores = {
+        name: [weights.get(name, 1.0) * s for s in normalize([h[2] for h in hits])] if hits else []
+        for name, hits in legs.items()
+    }
+    # Only legs that returned hits count, so a dropped leg doesn't cap scores
+    total = sum(weights.get(name, 1.0) for name, hits in legs.items() if hits)
+    return _merge(legs, leg_scores, total)
+
+def fuse(legs, method=FUSION_METHOD, weights=None):
+    """Fuse per-leg hit lists with the configured method (see module docstring)."""
+    if method == "rrf":
+        return rrf(legs, weights)
+    if method in ("minmax", "zscore"):
+        return weighted_sum(legs, weights, norm=method)
+    raise ValueError(f"Unknown FUSION_METHOD: {method!r} (expected rrf, minmax or zscore)")
@@ -0,0 +1,157 @@
+"""Admission control in front of Ollama generation.
+
+Ollama queues excess requests internally, so without a limit every `/ask`
+under load waits in an invisible queue and latency drifts toward
+`ANSWER_TIMEOUT`. `GenerationScheduler` makes the queue explicit:
+
+- at most `GEN_CONCURRENCY` answers are generated at once,
+- up to `GEN_QUEUE_MAX` more wait (FIFO) for a slot,
+- a request arriving to a full queue is rejected at once (HTTP 429), and one
+  that waits longer than `GEN_QUEUE_TIMEOUT` seconds is rejected (HTTP 503),
+  both with a Retry-After estimate derived from recent generation times.
+
+Queue depth, active slots, wait times and rejections are kept for `/status`.
+
+Environment variables:
+- `GEN_CONCURRENCY`   (default: `4`) — concurrent generations (match Ollama's `OLLAMA_NUM_PARALLEL`)
+- `GEN_QUEUE_MAX`     (default: `16`) — requests allowed to wait for a slot
+- `GEN_QUEUE_TIMEOUT` (default: `30`) — seconds a request may wait before 503
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+GEN_CONCURRENCY = int(os.getenv("GEN_CONCURRENCY", "4"))
+GEN_QUEUE_MAX = int(os.getenv("GEN_QUEUE_MAX", "16"))
+GEN_QUEUE_TIMEOUT = float(os.getenv("GEN_QUEUE_TIMEOUT", "30"))
+
+# Recent queue waits kept for percentiles
+_WAIT_WINDOW = 1000
+# Weight of the newest generation in the moving average used for Retry-After
+_HOLD_EWMA = 0.2
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status and Retry-After."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Slot:
+    """A granted generation slot; `release()` is idempotent."""
+
+    def __init__(self, scheduler, wait_s: float):
+        self.scheduler = scheduler
+        self.wait_s = wait_s
+        self.start = time.perf_counter()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._release(time.perf_counter() - self.start)
+
+class GenerationScheduler:
+    """Bounded-concurrency, bounded-queue admission for generations (event-loop only)."""
+
+    def __init__(self, concurrency: int = GEN_CONCURRENCY, queue_max: int = GEN_QUEUE_MAX,
+                 queue_timeout: float = GEN_QUEUE_TIMEOUT):
+        self.concurrency = max(1, concurrency)
+        self.queue_max = max(0, queue_max)
+        self.queue_timeout = queue_timeout
+        self._waiters = deque()  # FIFO of futures resolved when a slot is handed over
+        self.active = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+        self._waits = deque(maxlen=_WAIT_WINDOW)
+        self.avg_hold_s = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free for a newcomer (at least 1)."""
+        hold = self.avg_hold_s or 1.0
+        return max(1, math.ceil(hold * (self.waiting + 1) / self.concurrency))
+
+    async def acquire(self) -> Slot:
+        """Wait for a generation slot; raises `Overloaded` if the queue is full or the wait times out."""
+        t0 = time.perf_counter()
+        if self.active < self.concurrency and not self._waiters:
+            # Free slot: granted without suspending, so the caller can register
+            # its work before any other request runs
+            self.active += 1
+        elif len(self._waiters) >= self.queue_max:
+            self.rejected["queue_full"] += 1
+            raise Overloaded(429, "Generation queue is full", self.retry_after())
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected["timeout"] += 1
+                raise Overloaded(503, "Timed out waiting for a generation slot", self.retry_after()) from None
+            except BaseException:
+                # Cancelled after the slot was handed over: pass it on
+                if waiter.done() and not waiter.cancelled():
+                    self._handoff()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+        wait_s = time.perf_counter() - t0
+        self.admitted += 1
+        self.wait_total_s += wait_s
+        self.wait_max_s = max(self.wait_max_s, wait_s)
+        self._waits.append(wait_s)
+        return Slot(self, wait_s)
+
+    def _handoff(self):
+        # Give the freed slot to the oldest live waiter (`active` is unchanged)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _release(self, hold_s: float):
+        self._handoff()
+        if self.avg_hold_s is None:
+            self.avg_hold_s = hold_s
+        else:
+            self.avg_hold_s += _HOLD_EWMA * (hold_s - self.avg_hold_s)
+
+    def snapshot(self) -> dict:
+        """Current queue depth, slot usage, wait-time summary and rejection counts."""
+        waits = sorted(self._waits)
+
+        def pct(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else None
+
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "queue_max": self.queue_max,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_avg_s": self.wait_total_s / self.admitted if self.admitted else None,
+            "wait_p50_s": pct(0.50),
+            "wait_p95_s": pct(0.95),
+            "wait_max_s": self.wait_max_s,
+            "avg_generation_s": self.avg_hold_s,
+        }
@@ -4,23 +4,60 @@ Reads PDFs from a given folder, chunks pages into overlapping word windows,
 embeds them via an Ollama embedding model, and stores them in a persistent
 Chroma collection.
 
+With `--workers N` (or `INGEST_WORKERS`), text extraction and chunking run
+in a process pool: each PDF is split into page ranges of `PAGES_PER_TASK`
+pages, and chunks are streamed to the embedding stage as soon as each range
+finishes, so extraction scales with cores.
+
+Embedding is pipelined: chunks are embedded through Ollama's batch
+`/api/embed` endpoint with up to `EMBED_CONCURRENCY` requests in flight, the
+batch size adapts to observed request latency, and precomputed vectors are
+written to Chroma in batches of `WRITE_BATCH`. A chunks/sec figure is
+reported at the end.
+
+Chunk ids are deterministic (`<file sha256>-<path hash>-p<page>-o<word offset>`)
+and every run merges the ingested files (size, mtime, sha256), keyed by
+resolved path, into a manifest. Re-ingesting a file first deletes its
+previous chunks, so runs never duplicate content, and chunks of PDFs that
+have disappeared from the ingested folder are deleted on every run; files
+recorded from other folders are left alone. With `--incremental`, unchanged
+files are skipped and only new or changed files are (re)embedded, so a
+refresh costs time proportional to the delta.
+
+If a BM25 index exists, it is kept in sync as part of the run: chunks of
+removed or re-ingested files are tombstoned, and written chunks are added as
+new index segments every `BM25_SEGMENT_DOCS` chunks (see `bm25_index.py`).
+
 Environment variables:
 - `CHROMA_DIR`      (default: `./data/chroma`) — persistent DB path
 - `EMBED_MODEL`     (default: `nomic-embed-text`) — Ollama embed model name
 - `OLLAMA_URL`      (default: `http://localhost:11434`) — Ollama endpoint
 - `CHUNK_SIZE`      (default: `400`) — words per chunk
 - `CHUNK_OVERLAP`   (default: `100`) — overlapping words between chunks
+- `INGEST_WORKERS`  (default: `1`) — extraction processes (1 = in-process)
+- `PAGES_PER_TASK`  (default: `16`) — pages per extraction task
+- `EMBED_CONCURRENCY` (default: `4`) — embedding requests in flight
+- `EMBED_BATCH`     (default: `16`) — initial texts per embedding request
+- `EMBED_BATCH_MAX` (default: `256`) — upper bound for the adaptive batch
+- `EMBED_TARGET_S`  (default: `2.0`) — target seconds per embedding request
+- `WRITE_BATCH`     (default: `256`) — chunks per Chroma `add` call
+- `INGEST_MANIFEST` (default: `./data/ingest_manifest.json`) — ingested files record
+- `BM25_SEGMENT_DOCS` (default: `10000`) — chunks per new BM25 index segment
 
 Usage:
-    python ingest.py data/docs
+    python ingest.py data/docs [--workers 8] [--incremental]
 """
 
-import os, sys, uuid
+import os, json, hashlib, argparse, time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from pathlib import Path
 import fitz  # PyMuPDF
 import chromadb
 from chromadb.utils import embedding_functions
 from dotenv import load_dotenv
+from embeddings import embed_texts
+import bm25_index
 
 # Load config
 load_dotenv()
@@ -31,6 +68,33 @@ OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 # Chunking controls: window size and overlap measured in words
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "400"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+# Parallel extraction controls
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+PAGES_PER_TASK = int(os.getenv("PAGES_PER_TASK", "16"))
+# Embedding pipeline controls
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "16"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "256"))
+EMBED_TARGET_S = float(os.getenv("EMBED_TARGET_S", "2.0"))
+WRITE_BATCH = int(os.getenv("WRITE_BATCH", "256"))
+# Record of ingested files used for incremental refreshes
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST", "./data/ingest_manifest.json")
+# Chunks buffered before they are flushed to the BM25 index as one segment
+BM25_SEGMENT_DOCS = int(os.getenv("BM25_SEGMENT_DOCS", "10000"))
+
+def chunk_page(words, source_file, page_num):
+    """Split one page's words into overlapping windows of `CHUNK_SIZE` words.
+
+    Returns a list of (chunk_text, metadata) pairs with `source_file`,
+    `page_number` and `word_offset` metadata.
+    """
+    chunks = []
+    # Slide a window with overlap to create dense coverage
+    for i in range(0, len(words), CHUNK_SIZE - CHUNK_OVERLAP):
+        chunk = " ".join(words[i:i + CHUNK_SIZE]).strip()
+        if chunk:
+            chunks.append((chunk, {"source_file": source_file, "page_number": page_num, "word_offset": i}))
+    return chunks
 
 def extract_chunks(pdf: Path):
     """Yield (chunk_text, metadata) pairs for a single PDF.
@@ -42,56 +106,370 @@ def extract_chunks(pdf: Path):
         for page_num, page in enumerate(doc, start=1):
             # Extract raw page text and split into word tokens
             words = page.get_text("text").split()
-            # Slide a window with overlap to create dense coverage
-            for i in range(0, len(words), CHUNK_SIZE - CHUNK_OVERLAP):
-                chunk = " ".join(words[i:i + CHUNK_SIZE]).strip()
-                if chunk:
-                    yield chunk, {"source_file": pdf.name, "page_number": page_num}
+            yield from chunk_page(words, pdf.name, page_num)
+
+def extract_page_range(pdf_path: str, start: int, end: int):
+    """Extract chunks for pages [start, end) of a PDF (0-based page indexes).
+
+    Top-level so it can run in a worker process; returns a list rather than a
+    generator so results can be pickled back to the parent.
+    """
+    pdf = Path(pdf_path)
+    chunks = []
+    with fitz.open(pdf) as doc:
+        for page_index in range(start, min(end, doc.page_count)):
+            words = doc[page_index].get_text("text").split()
+            chunks.extend(chunk_page(words, pdf.name, page_index + 1))
+    return chunks
+
+def plan_extraction(pdfs, pages_per_task: int = PAGES_PER_TASK):
+    """Split PDFs into (pdf, start, end) page-range tasks for the process pool."""
+    tasks = []
+    for pdf in pdfs:
+        with fitz.open(pdf) as doc:
+            page_count = doc.page_count
+        for start in range(0, max(page_count, 1), pages_per_task):
+            tasks.append((pdf, start, start + pages_per_task))
+    return tasks
+
+def iter_extracted(pdfs, workers: int = INGEST_WORKERS):
+    """Yield (pdf, chunks, file_done) as extraction results become available.
+
+    - workers <= 1: extracts each PDF in-process, one result per file.
+    - workers > 1: fans page-range tasks out over a process pool and yields
+      each range as soon as it completes (order is not preserved).
+      `file_done` is True on the last range of a file, so callers can report
+      per-file totals.
+    """
+    if workers <= 1:
+        for pdf in pdfs:
+            yield pdf, list(extract_chunks(pdf)), True
+        return
+
+    tasks = plan_extraction(pdfs)
+    remaining = defaultdict(int)
+    for pdf, _, _ in tasks:
+        remaining[pdf] += 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(extract_page_range, str(pdf), start, end): pdf
+            for pdf, start, end in tasks
+        }
+        for future in as_completed(futures):
+            pdf = futures[future]
+            remaining[pdf] -= 1
+            yield pdf, future.result(), remaining[pdf] == 0
+
+# ------------------------------------
+# Content hashes and the ingest manifest
+# ------------------------------------
+def file_sha256(path: Path) -> str:
+    """Hash a file's bytes in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(sha256: str, meta: dict) -> str:
+    """Deterministic chunk id from file hash + page + word offset.
+
+    A short hash of the file's path is included so two copies of the same PDF
+    (under different names or folders) don't overwrite each other's chunks.
+    """
+    path_hash = hashlib.sha256(meta["source_path"].encode("utf-8")).hexdigest()[:8]
+    return f"{sha256[:16]}-{path_hash}-p{meta['page_number']}-o{meta['word_offset']}"
+
+def manifest_key(pdf: Path) -> str:
+    """Manifest key (and `source_path` chunk metadata) of a PDF: its resolved path."""
+    return str(pdf.resolve())
+
+def load_manifest(path: str = MANIFEST_PATH, root: Path = None) -> dict:
+    """Return {resolved path: {size, mtime, sha256, chunks}} from earlier runs.
+
+    Manifests written before entries were keyed by path used bare file names;
+    those entries are adopted as files of `root` (the folder being ingested)
+    and marked `legacy`, since their chunks carry no `source_path`.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if root is not None:
+        for key in [k for k in manifest if not os.path.isabs(k)]:
+            manifest.setdefault(manifest_key(root / key), {**manifest.pop(key), "legacy": True})
+    return manifest
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    """Persist the manifest atomically (temp file + replace)."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def removed_files(manifest, root: Path, pdfs):
+    """Manifest keys of PDFs directly in `root` that are no longer on disk.
+
+    Entries from other folders are not touched, so ingesting another folder
+    never deletes chunks of files recorded from this one.
+    """
+    root = root.resolve()
+    on_disk = {manifest_key(pdf) for pdf in pdfs}
+    return [key for key in manifest if Path(key).parent == root and key not in on_disk]
+
+def chunk_filter(key: str, entry: dict = None) -> dict:
+    """Chroma `where` filter selecting the chunks of one manifest entry."""
+    if entry and entry.get("legacy"):
+        return {"source_file": Path(key).name}
+    return {"source_path": key}
+
+def plan_incremental(pdfs, manifest):
+    """Compare PDFs on disk with the manifest.
+
+    Size and mtime are checked first; the file is only hashed when they
+    differ, and a matching hash just refreshes the recorded mtime.
+
+    Returns (to_ingest, file_info): PDFs that are new or changed, and
+    {resolved path: stat + sha256} for every PDF on disk.
+    """
+    to_ingest, file_info = [], {}
+    for pdf in pdfs:
+        key = manifest_key(pdf)
+        st = pdf.stat()
+        entry = manifest.get(key)
+        if entry and not entry.get("legacy") and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            file_info[key] = dict(entry)
+            continue
+        sha = file_sha256(pdf)
+        file_info[key] = {"size": st.st_size, "mtime": st.st_mtime, "sha256": sha}
+        if entry and not entry.get("legacy") and entry["sha256"] == sha:
+            file_info[key]["chunks"] = entry.get("chunks", 0)
+            continue  # touched but identical content
+        to_ingest.append(pdf)
+    return to_ingest, file_info
+
+class EmbeddingPipeline:
+    """Embed chunks concurrently with an adaptive batch size, then write to Chroma.
+
+    - `submit(chunks)` buffers (id, text, meta) triples and dispatches
+      embedding requests of the current batch size to a thread pool, keeping
+      at most `concurrency` requests in flight (callers block when full).
+    - After each request the batch size adapts to its latency: it doubles
+      while requests finish well under `target_s` and halves when they exceed
+      it, bounded by [1, `batch_max`].
+    - Embedded chunks are written with precomputed `embeddings` in
+      `write_batch`-sized `collection.upsert` calls from the caller's thread.
+    - `on_write(rows)`, if given, is called with each written batch of
+      (id, text, meta) triples.
+    - `close()` flushes everything and returns the number of chunks written.
+    """
+
+    def __init__(self, collection, concurrency=EMBED_CONCURRENCY, batch=EMBED_BATCH,
+                 batch_max=EMBED_BATCH_MAX, target_s=EMBED_TARGET_S, write_batch=WRITE_BATCH,
+                 on_write=None):
+        self.collection = collection
+        self.on_write = on_write
+        self.concurrency = max(1, concurrency)
+        self.batch = max(1, batch)
+        self.batch_max = max(self.batch, batch_max)
+        self.target_s = target_s
+        self.write_batch = max(1, write_batch)
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed")
+        self.pending = []      # (id, text, meta) waiting to be dispatched
+        self.inflight = set()  # futures of running embedding requests
+        self.ready = []        # (id, text, meta, embedding) waiting to be written
+        self.written = 0
+        self.t0 = time.perf_counter()
+
+    @staticmethod
+    def _embed(items):
+        t0 = time.perf_counter()
+        vectors = embed_texts([text for _, text, _ in items])
+        return items, vectors, time.perf_counter() - t0
+
+    def _adapt(self, latency):
+        """Grow the batch while requests are fast, shrink it when they are slow."""
+        if latency < self.target_s / 2 and self.batch < self.batch_max:
+            self.batch = min(self.batch * 2, self.batch_max)
+        elif latency > self.target_s and self.batch > 1:
+            self.batch = max(self.batch // 2, 1)
+
+    def _collect(self, block):
+        """Harvest finished requests (waiting for at least one if `block`)."""
+        if not self.inflight:
+            return
+        done, self.inflight = wait(self.inflight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            items, vectors, latency = future.result()
+            self._adapt(latency)
+            self.ready.extend((i, t, m, v) for (i, t, m), v in zip(items, vectors))
+        self._write(force=False)
+
+    def _dispatch(self, flush):
+        """Send full batches (and the remainder if `flush`) to the pool."""
+        while self.pending and (len(self.pending) >= self.batch or flush):
+            if len(self.inflight) >= self.concurrency:
+                self._collect(block=True)  # backpressure
+                continue
+            items, self.pending = self.pending[:self.batch], self.pending[self.batch:]
+            self.inflight.add(self.pool.submit(self._embed, items))
+
+    def _write(self, force):
+        while self.ready and (len(self.ready) >= self.write_batch or force):
+            rows, self.ready = self.ready[:self.write_batch], self.ready[self.write_batch:]
+            # Upsert: ids are deterministic, so retries overwrite in place
+            self.collection.upsert(
+                ids=[r[0] for r in rows],
+                documents=[r[1] for r in rows],
+                metadatas=[r[2] for r in rows],
+                embeddings=[r[3] for r in rows],
+            )
+            self.written += len(rows)
+            if self.on_write:
+                self.on_write([r[:3] for r in rows])
+            print(f"[write] {len(rows)} chunks (total {self.written}, {self.rate():.1f} chunks/s, batch={self.batch})")
+
+    def rate(self):
+        """Chunks written per second since the pipeline started."""
+        elapsed = time.perf_counter() - self.t0
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    def submit(self, chunks):
+        """Queue (id, text, meta) triples for embedding and writing."""
+        self.pending.extend(chunks)
+        self._dispatch(flush=False)
+        self._collect(block=False)
+
+    def close(self):
+        """Embed and write everything still queued; returns chunks written."""
+        self._dispatch(flush=True)
+        while self.inflight:
+            self._collect(block=True)
+        self._write(force=True)
+        self.pool.shutdown()
+        return self.written
+
+class LexicalIndexUpdater:
+    """Keep an existing BM25 index in sync with the chunks written to Chroma.
+
+    Written chunks are buffered and added to the index as one new segment per
+    `segment_docs` chunks; deletions are tombstoned immediately. Does nothing
+    when no index exists yet (`bm25_query` builds one from Chroma on first use).
+    """
+
+    def __init__(self, segment_docs=BM25_SEGMENT_DOCS):
+        self.enabled = bm25_index.index_exists()
+        self.segment_docs = max(1, segment_docs)
+        self.buffer = []
+        self.added = 0
+        self.deleted = 0
+
+    def delete(self, ids):
+        if self.enabled and ids:
+            self.deleted += bm25_index.delete_documents(ids)
+
+    def add(self, rows):
+        if not self.enabled:
+            return
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.segment_docs:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            rows, self.buffer = self.buffer, []
+            bm25_index.add_documents([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+            self.added += len(rows)
+            print(f"[bm25] segment of {len(rows)} chunks added (total {self.added})")
 
 def main():
     """CLI entrypoint: ingest all PDFs in the provided folder."""
-    if len(sys.argv) < 2:
-        print("Usage: python ingest.py data/docs")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Chunk + embed PDFs into ChromaDB.")
+    parser.add_argument("folder", help="folder containing PDFs, e.g. data/docs")
+    parser.add_argument(
+        "--workers", type=int, default=INGEST_WORKERS,
+        help="extraction processes (default: INGEST_WORKERS or 1)",
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="only embed new/changed files and drop chunks of removed ones",
+    )
+    args = parser.parse_args()
 
-    in_path = Path(sys.argv[1])
+    in_path = Path(args.folder)
     pdfs = list(in_path.glob("*.pdf"))
+    manifest = load_manifest(root=in_path)
+    # Files recorded from this folder that are gone: purge them in every mode
+    removed = removed_files(manifest, in_path, pdfs)
 
-    if not pdfs:
+    if not pdfs and not removed:
         print("No PDFs found.")
         return
 
+    if args.incremental:
+        to_ingest, file_info = plan_incremental(pdfs, manifest)
+        print(
+            f"[incremental] {len(to_ingest)} new/changed, {len(removed)} removed, "
+            f"{len(pdfs) - len(to_ingest)} unchanged"
+        )
+    else:
+        to_ingest = pdfs
+        file_info = {}
+        for pdf in pdfs:
+            st = pdf.stat()
+            file_info[manifest_key(pdf)] = {"size": st.st_size, "mtime": st.st_mtime, "sha256": file_sha256(pdf)}
+
     # Initialize persistent Chroma client and embedding function via Ollama
     client = chromadb.PersistentClient(path=CHROMA_DIR)
     embedder = embedding_functions.OllamaEmbeddingFunction(model_name=EMBED_MODEL, url=OLLAMA_URL)
     collection = client.get_or_create_collection("docs", embedding_function=embedder)
 
-    total = 0
-    for pdf in pdfs:
-        # Extract chunked text and simple metadata per page
-        chunks = list(extract_chunks(pdf))
-        if not chunks:
-            print(f"[skip] {pdf.name} – no text found")
-            continue
+    lexical = LexicalIndexUpdater()
 
-        # Prepare batched add to avoid very large requests
-        docs = [c[0] for c in chunks]
-        metas = [c[1] for c in chunks]
-        ids = [str(uuid.uuid4()) for _ in chunks]
-
-        BATCH_SIZE = 8  # Adjust if needed
-        for j in range(0, len(docs), BATCH_SIZE):
-            collection.add(
-                documents=docs[j:j+BATCH_SIZE],
-                metadatas=metas[j:j+BATCH_SIZE],
-                ids=ids[j:j+BATCH_SIZE],
-            )
-            print(f"[batch {j//BATCH_SIZE + 1}/{(len(docs)-1)//BATCH_SIZE + 1}] added {len(docs[j:j+BATCH_SIZE])} chunks…")
+    # Drop stale chunks: removed files, and previous versions of files being re-ingested
+    for key in removed + [manifest_key(pdf) for pdf in to_ingest]:
+        where = chunk_filter(key, manifest.get(key))
+        if lexical.enabled:
+            lexical.delete(collection.get(where=where, include=[])["ids"])
+        collection.delete(where=where)
+    for key in removed:
+        print(f"[-] {key}: removed, chunks deleted")
+
+    pipeline = EmbeddingPipeline(collection, on_write=lexical.add)
+    per_file = defaultdict(int)
+    # Chunks stream in per file (sequential) or per page range (parallel)
+    for pdf, chunks, file_done in iter_extracted(to_ingest, args.workers):
+        key = manifest_key(pdf)
+        if chunks:
+            sha = file_info[key]["sha256"]
+            metas = [{**meta, "source_path": key, "file_sha256": sha} for _, meta in chunks]
+            pipeline.submit([
+                (chunk_id(sha, meta), text, meta)
+                for (text, _), meta in zip(chunks, metas)
+            ])
+            per_file[pdf] += len(chunks)
 
-        print(f"[+] {pdf.name}: {len(docs)} chunks")
-        total += len(docs)
+        if file_done:
+            file_info[key]["chunks"] = per_file[pdf]
+            if per_file[pdf]:
+                print(f"[+] {pdf.name}: {per_file[pdf]} chunks queued")
+            else:
+                print(f"[skip] {pdf.name} – no text found")
 
-    print(f"\nIngest complete. {total} chunks added.")
+    total = pipeline.close()
+    lexical.flush()
+    # Only record files once their chunks are safely written; entries from
+    # other folders are kept
+    for key in removed:
+        manifest.pop(key, None)
+    manifest.update(file_info)
+    save_manifest(manifest)
+    print(f"\nIngest complete. {total} chunks added ({pipeline.rate():.1f} chunks/s).")
+    if lexical.enabled:
+        print(f"BM25 index updated: {lexical.added} chunks added, {lexical.deleted} deleted.")
 
 if __name__ == "__main__":
     main()
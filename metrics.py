@@ -0,0 +1,177 @@
+"""Minimal Prometheus-style metrics for the RAG pipeline.
+
+A dependency-free subset of the Prometheus client: counters, histograms and
+callback metrics (values read at scrape time), rendered in the text
+exposition format served at `/metrics` by `app_fastapi.py`.
+
+The pipeline metrics are defined here so every module records into the same
+series:
+
+- stage latency histograms: embedding, vector search, BM25, fusion,
+  retrieval (both legs), prompt build, queue wait, time to first token and
+  generation
+- counters: answer-cache lookups by result, errors by stage, prompt and
+  completion tokens
+
+Observations are thread-safe (retrieval legs run on a thread pool).
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; retrieval stages are sub-second, generation runs to minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+GENERATION_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+_REGISTRY = []
+
+def _fmt(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    """Monotonic counter, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_fmt(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with `_sum` and `_count`, optionally split by labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the `with` block."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', _fmt(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+class Callback(_Metric):
+    """Gauge or counter whose value is read from `fn()` at scrape time.
+
+    `fn` returns a number, or a dict mapping label values (a tuple, or a
+    single value for one label) to numbers. `None` values are skipped.
+    """
+
+    def __init__(self, name, help, fn, kind="gauge", labels=()):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        lines = []
+        for key, v in sorted(value.items(), key=lambda kv: str(kv[0])):
+            if v is None:
+                continue
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_fmt(v)}")
+        return lines
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _REGISTRY:
+        try:
+            samples = metric.samples()
+        except Exception as e:
+            print(f"[warn] Metric {metric.name} failed: {e}")
+            continue
+        lines += metric.header() + samples
+    return "\n".join(lines) + "\n"
+
+# ------------------------------------
+# Pipeline metrics
+# ------------------------------------
+EMBED_SECONDS = Histogram("rag_embedding_seconds", "Query embedding latency (cache or Ollama)")
+VECTOR_SEARCH_SECONDS = Histogram("rag_vector_search_seconds", "Chroma nearest-neighbour query latency")
+BM25_SECONDS = Histogram("rag_bm25_seconds", "BM25 query latency")
+FUSION_SECONDS = Histogram("rag_fusion_seconds", "Fusion and dedup of the retrieval legs")
+RETRIEVAL_SECONDS = Histogram("rag_retrieval_seconds", "Hybrid retrieval latency (both legs + fusion)")
+PROMPT_BUILD_SECONDS = Histogram("rag_prompt_build_seconds", "Prompt construction and context packing")
+QUEUE_WAIT_SECONDS = Histogram("rag_queue_wait_seconds", "Wait for a generation slot", GENERATION_BUCKETS)
+TTFT_SECONDS = Histogram("rag_time_to_first_token_seconds", "Request start to first streamed token", GENERATION_BUCKETS)
+GENERATION_SECONDS = Histogram("rag_generation_seconds", "Ollama generation latency", GENERATION_BUCKETS)
+
+CACHE_LOOKUPS = Counter("rag_answer_cache_lookups_total", "Answer-cache lookups by result", ["result"])
+ERRORS = Counter("rag_errors_total", "Failures by pipeline stage", ["stage"])
+TOKENS = Counter("rag_tokens_total", "Tokens processed by Ollama", ["kind"])
@@ -0,0 +1,143 @@
+"""Shared, pooled HTTP client for every Ollama call.
+
+A bare `requests.post` opens a fresh TCP connection per call. This module
+keeps one `requests.Session` per process with a keep-alive connection pool,
+so generation, streaming and embedding requests reuse connections under
+concurrent load. Transient failures (connection errors, 502/503/504) are
+retried with exponential backoff, and every call uses the same
+(connect, read) timeout convention.
+
+Retries only cover failures before a response body is consumed, so a
+streamed answer is never replayed midway.
+
+Async callers (the FastAPI app) use the `httpx.AsyncClient` counterpart:
+`apost` / `astream` share the same pool size, retry policy and timeouts,
+but never block a thread while waiting on Ollama. Close it on shutdown with
+`aclose()`.
+
+Environment variables:
+- `OLLAMA_POOL_SIZE`       (default: `16`) — max pooled connections to Ollama
+- `OLLAMA_RETRIES`         (default: `3`) — retries on transient errors
+- `OLLAMA_BACKOFF`         (default: `0.5`) — backoff factor (0.5s, 1s, 2s, ...)
+- `OLLAMA_CONNECT_TIMEOUT` (default: `5`) — seconds to establish a connection
+"""
+
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+
+import httpx
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+load_dotenv()
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "16"))
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "3"))
+OLLAMA_BACKOFF = float(os.getenv("OLLAMA_BACKOFF", "0.5"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+
+# Statuses worth retrying: Ollama restarting or a proxy in front of it failing over
+RETRY_STATUSES = (502, 503, 504)
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_ASYNC_CLIENT = None
+
+def _build_session():
+    retry = Retry(
+        total=OLLAMA_RETRIES,
+        connect=OLLAMA_RETRIES,
+        read=0,  # a read timeout means Ollama is busy generating; don't pile on
+        status=OLLAMA_RETRIES,
+        backoff_factor=OLLAMA_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first call (thread-safe)."""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                _SESSION = _build_session()
+    return _SESSION
+
+def post(url: str, payload: dict, timeout: float, stream: bool = False):
+    """POST JSON to Ollama over the pooled session.
+
+    `timeout` is the read timeout in seconds (the connect timeout is
+    `OLLAMA_CONNECT_TIMEOUT`). Raises `requests.HTTPError` for error statuses
+    that remain after retries. With `stream=True`, use the response as a
+    context manager so its connection returns to the pool.
+    """
+    r = get_session().post(url, json=payload, stream=stream, timeout=(OLLAMA_CONNECT_TIMEOUT, timeout))
+    if r.status_code >= 400:
+        r.close()
+    r.raise_for_status()
+    return r
+
+# ------------------------------------
+# Async client
+# ------------------------------------
+def get_async_client():
+    """Return the process-wide `httpx.AsyncClient`, creating it on first call.
+
+    Connections beyond `OLLAMA_POOL_SIZE` wait for a free slot instead of
+    failing, so bursts queue up client-side rather than erroring.
+    """
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None or _ASYNC_CLIENT.is_closed:
+        _ASYNC_CLIENT = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=OLLAMA_POOL_SIZE, max_keepalive_connections=OLLAMA_POOL_SIZE),
+            transport=httpx.AsyncHTTPTransport(retries=OLLAMA_RETRIES),  # connect errors
+        )
+    return _ASYNC_CLIENT
+
+async def aclose():
+    """Close the async client and its pooled connections."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is not None:
+        await _ASYNC_CLIENT.aclose()
+        _ASYNC_CLIENT = None
+
+def _timeout(timeout):
+    return httpx.Timeout(timeout, connect=OLLAMA_CONNECT_TIMEOUT, pool=None)
+
+@asynccontextmanager
+async def astream(url: str, payload: dict, timeout: float):
+    """Async context manager for a streamed POST; yields the `httpx.Response`.
+
+    Statuses in `RETRY_STATUSES` are retried with backoff before the body is
+    read; other error statuses raise `httpx.HTTPStatusError`. Leaving the
+    block closes the response, which aborts an unfinished stream upstream.
+    """
+    client = get_async_client()
+    for attempt in range(OLLAMA_RETRIES + 1):
+        request = client.build_request("POST", url, json=payload, timeout=_timeout(timeout))
+        r = await client.send(request, stream=True)
+        if r.status_code in RETRY_STATUSES and attempt < OLLAMA_RETRIES:
+            await r.aclose()
+            await asyncio.sleep(OLLAMA_BACKOFF * 2 ** attempt)
+            continue
+        try:
+            r.raise_for_status()
+            yield r
+        finally:
+            await r.aclose()
+        return
+
+async def apost(url: str, payload: dict, timeout: float):
+    """POST JSON to Ollama without blocking; returns the decoded JSON body."""
+    async with astream(url, payload, timeout) as r:
+        await r.aread()
+        return r.json()
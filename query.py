@@ -1,7 +1,7 @@
 """Simple ChromaDB query helper.
 
 Loads a persistent Chroma collection, embeds the input query via an Ollama
-embedding model, searches top-k similar chunks, and prints results above a
+embedding model (through the on-disk embedding cache), searches top-k similar chunks, and prints results above a
 minimum similarity threshold.
 
 Environment variables:
@@ -16,6 +16,7 @@ import os, sys
 from dotenv import load_dotenv
 import chromadb
 from chromadb.utils import embedding_functions
+from embeddings import embed_query
 
 load_dotenv()
 # Configuration (overridable via environment)
@@ -39,7 +40,7 @@ def ask(query):
     - Filters out results with similarity below `MIN_SCORE`.
     """
     res = collection.query(
-        query_texts=[query],
+        query_embeddings=[embed_query(query)],  # cached query embedding
         n_results=TOP_K,
         include=["documents", "metadatas", "distances"]
     )
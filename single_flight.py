@@ -0,0 +1,144 @@
+"""Single-flight coalescing of identical in-flight requests.
+
+When many users ask the same question within seconds, each `/ask` would
+run its own retrieval and Ollama generation. `SingleFlight` lets the first
+request for a key do the work while identical concurrent requests attach
+to it:
+
+- `do(key, factory)` — awaitable work (the JSON `/ask`): every caller gets
+  the leader's result (or exception). A caller that gives up does not
+  cancel the shared work for the others.
+- `subscribe(key, factory)` — event streams (the SSE `/ask`): every
+  subscriber receives all events, late joiners get the ones already sent
+  replayed first. When the last subscriber leaves, the shared stream is
+  cancelled (which aborts the upstream Ollama generation).
+
+A key is only shared while its work is running; once it finishes the next
+request starts fresh (and usually hits the answer cache instead).
+
+Both accept an `on_finish` callback for resources reserved before the call
+(e.g. a generation slot): it runs when the work started by this call ends,
+or immediately if the call joined work already in flight.
+
+Everything runs on the event loop, so no locking is needed.
+"""
+
+import asyncio
+
+_END = object()
+
+class _StreamFlight:
+    """One shared event stream and the queues of its subscribers."""
+
+    def __init__(self, owner, key, events):
+        self.owner = owner
+        self.key = key
+        self.history = []
+        self.queues = set()
+        self.stopped = False
+        self.task = asyncio.create_task(self._run(events))
+
+    async def _run(self, events):
+        try:
+            async for event in events:
+                self.history.append(event)
+                for queue in self.queues:
+                    queue.put_nowait(event)
+        finally:
+            self.owner._release(self.owner._streams, self.key, self)
+            for queue in self.queues:
+                queue.put_nowait(_END)
+
+    def join(self):
+        queue = asyncio.Queue()
+        for event in self.history:
+            queue.put_nowait(event)
+        self.queues.add(queue)
+        return queue
+
+    def leave(self, queue):
+        self.queues.discard(queue)
+        if not self.queues and not self.task.done():
+            self.stop()
+
+    def stop(self):
+        # Cancel once: a repeated cancel would interrupt the upstream close
+        if not self.stopped:
+            self.stopped = True
+            # New requests must not join a stream that is shutting down
+            self.owner._release(self.owner._streams, self.key, self)
+            self.task.cancel()
+
+class SingleFlight:
+    """Registry of in-flight work keyed by request identity.
+
+    `started` counts requests that did the work, `joined` those that shared
+    another request's work.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._streams = {}
+        self.started = 0
+        self.joined = 0
+
+    @staticmethod
+    def _release(registry, key, flight):
+        if registry.get(key) is flight:
+            del registry[key]
+
+    def in_flight(self) -> int:
+        """Number of distinct keys currently being worked on."""
+        return len(self._tasks) + len(self._streams)
+
+    def is_running(self, key) -> bool:
+        """Whether work for `key` is in flight (a new call would join it)."""
+        return key in self._tasks or key in self._streams
+
+    async def do(self, key, factory, on_finish=None):
+        """Await `factory()` once per key; concurrent callers share its result."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._release(self._tasks, key, t))
+            if on_finish is not None:
+                task.add_done_callback(lambda t: on_finish())
+            self.started += 1
+        else:
+            self.joined += 1
+            if on_finish is not None:
+                on_finish()
+        # Shield: one caller disconnecting must not cancel everyone's answer
+        return await asyncio.shield(task)
+
+    def subscribe(self, key, factory, on_finish=None):
+        """Join (or start) the shared stream for `key`; returns an async generator of its events.
+
+        `factory()` must return an async iterable; it is only called when no
+        stream for `key` is in flight. Closing the generator unsubscribes.
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight(self, key, factory())
+            self._streams[key] = flight
+            if on_finish is not None:
+                flight.task.add_done_callback(lambda t: on_finish())
+            self.started += 1
+        else:
+            self.joined += 1
+            if on_finish is not None:
+                on_finish()
+            print(f"[coalesce] joined in-flight answer ({len(flight.queues) + 1} subscribers)")
+        return self._relay(flight, flight.join())
+
+    @staticmethod
+    async def _relay(flight, queue):
+        try:
+            while True:
+                event = await queue.get()
+                if event is _END:
+                    break
+                yield event
+        finally:
+            flight.leave(queue)
@@ -1,9 +1,10 @@
 // Client-side logic for querying /ask and rendering either
-// a full JSON answer or a streamed text response controlled by .env.
+// a full JSON answer or a Server-Sent Events stream (controlled by .env).
 document.addEventListener("DOMContentLoaded", () => {
   // Containers for dynamic content and a simple loading indicator
   const answerEl = document.getElementById("answer");
   const matchesEl = document.getElementById("matches");
+  const statsEl = document.getElementById("stats");
   const spinner = document.getElementById("spinner");
 
   // Render top matches into a simple <ul> list
@@ -18,31 +19,66 @@ document.addEventListener("DOMContentLoaded", () => {
       `</ul>`;
   }
 
-  // Consume ReadableStream from fetch and append decoded text chunks
-  async function streamTextResponse(res) {
-    // Hide spinner once streaming begins
-    spinner.style.display = "none";
-
-    try {
-      const header = res.headers.get('X-Matches');
-      if (header) {
-        const matches = JSON.parse(header);
-        renderMatches(matches);
-      }
-    } catch (e) {
-      console.warn('Failed to parse X-Matches header:', e);
-    }
+  // Render latency and token counters from the final stats event
+  function renderStats(s) {
+    const fmt = (v, digits = 2) => (v === null || v === undefined ? "–" : Number(v).toFixed(digits));
+    const parts = [
+      `retrieval ${fmt(s.retrieval_s)}s`,
+      `first token ${fmt(s.ttft_s)}s`,
+      `total ${fmt(s.total_s)}s`,
+      `${fmt(s.tokens_per_s, 1)} tok/s`,
+      `tokens ${s.prompt_eval_count ?? "–"} prompt + ${s.eval_count ?? "–"} gen`,
+    ];
+    if (s.cache && s.cache !== "miss") parts.push(`cached (${s.cache})`);
+    statsEl.textContent = parts.join(" | ");
+  }
 
+  // Parse a fetch() body as Server-Sent Events and dispatch each event
+  async function streamEvents(res) {
     answerEl.innerHTML = `<h2>Answer</h2><pre id="answer-text" style="white-space: pre-wrap"></pre>`;
-    const target = document.getElementById('answer-text');
+    const target = document.getElementById("answer-text");
+
+    const handlers = {
+      matches: data => renderMatches(data.matches),
+      token: data => {
+        // Hide spinner once the first token arrives
+        spinner.style.display = "none";
+        target.textContent += data.text;
+      },
+      stats: data => renderStats(data),
+      error: data => {
+        target.textContent += `\n[error] ${data.message}`;
+      },
+    };
 
     const reader = res.body.getReader();
     const decoder = new TextDecoder();
+    let buffer = "";
     while (true) {
       const { value, done } = await reader.read();
       if (done) break;
-      target.textContent += decoder.decode(value, { stream: true });
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line
+      let sep;
+      while ((sep = buffer.indexOf("\n\n")) !== -1) {
+        const raw = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        let event = "message";
+        const dataLines = [];
+        for (const line of raw.split("\n")) {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+        }
+        if (!dataLines.length || !handlers[event]) continue;
+        try {
+          handlers[event](JSON.parse(dataLines.join("\n")));
+        } catch (e) {
+          console.warn(`Failed to handle ${event} event:`, e);
+        }
+      }
     }
+    spinner.style.display = "none";
   }
 
   // Submit handler: decides between JSON and streaming based on Content-Type
@@ -51,6 +87,7 @@ document.addEventListener("DOMContentLoaded", () => {
     const q = document.getElementById("query").value;
     answerEl.textContent = "";
     matchesEl.textContent = "";
+    statsEl.textContent = "";
 
     // Show spinner when request starts
     spinner.style.display = "inline-block";
@@ -59,13 +96,21 @@ document.addEventListener("DOMContentLoaded", () => {
       const res = await fetch(`/ask?query=${encodeURIComponent(q)}`);
       const contentType = res.headers.get('content-type') || '';
 
-      if (contentType.includes('application/json')) {
+      if (res.status === 429 || res.status === 503) {
+        // Server is saturated; Retry-After says when to try again
+        spinner.style.display = "none";
+        const data = await res.json().catch(() => ({}));
+        const retry = res.headers.get('retry-after');
+        answerEl.innerHTML = `<p>Server busy: ${data.detail || res.statusText}.` +
+          (retry ? ` Please retry in ${retry}s.` : "") + `</p>`;
+      } else if (contentType.includes('application/json')) {
         spinner.style.display = "none";
         const data = await res.json();
         answerEl.innerHTML = `<h2>Answer</h2><p>${data.answer}</p>`;
         renderMatches(data.matches || []);
-      } else if (contentType.includes('text/plain')) {
-        await streamTextResponse(res);
+        if (data.timing) renderStats({ ...data.timing, cache: data.cache });
+      } else if (contentType.includes('text/event-stream')) {
+        await streamEvents(res);
       } else {
         spinner.style.display = "none";
         answerEl.innerHTML = `<p>Unexpected response type: ${contentType}</p>`;
@@ -0,0 +1,235 @@
+"""Lightweight per-request tracing for the RAG pipeline.
+
+Histograms (`metrics.py`) show where latency goes on average; a trace shows
+where it went for one slow `/ask`. A trace is a tree of spans (name, start,
+duration, attributes such as hit or token counts, status) sharing a
+`trace_id`:
+
+    with tracing.trace("ask", request_id=rid):        # root, in app_fastapi
+        with tracing.span("retrieve") as sp:           # anywhere below it
+            ...
+            sp.set(hits=len(hits))
+
+The current span travels in a `contextvars.ContextVar`, so it follows
+`await`s and tasks; wrap functions submitted to a thread pool with `bind()`
+to carry it into the worker. Outside a trace (CLI scripts), `span()` is a
+no-op.
+
+Finished spans are exported whenever a trace has no open span left: one JSON
+object per line to `TRACE_FILE`, and, if `TRACE_OTLP_ENDPOINT` is set, as
+OTLP/HTTP JSON to that collector. Both exporters run on background threads,
+so request handlers never wait on disk or network I/O.
+
+Environment variables:
+- `TRACING`             (default: `true`) — record and export spans
+- `TRACE_FILE`          (default: `./data/traces.jsonl`) — JSONL span log ('' to disable)
+- `TRACE_OTLP_ENDPOINT` (default: unset) — e.g. `http://localhost:4318/v1/traces`
+- `TRACE_SERVICE_NAME`  (default: `local-rag`) — `service.name` sent with OTLP spans
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+TRACING = os.getenv("TRACING", "true").lower() == "true"
+TRACE_FILE = os.getenv("TRACE_FILE", "./data/traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "local-rag")
+
+_CURRENT = contextvars.ContextVar("rag_current_span", default=None)
+# One thread per exporter keeps batches in order; created on first export
+_FILE_POOL = None
+_OTLP_POOL = None
+_POOL_LOCK = threading.Lock()
+
+class _Trace:
+    """Spans of one trace; flushes finished spans whenever none is open."""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.open = 0
+        self.finished = []
+        self.lock = threading.Lock()
+
+    def started(self):
+        with self.lock:
+            self.open += 1
+
+    def ended(self, span):
+        with self.lock:
+            self.open -= 1
+            self.finished.append(span)
+            if self.open:
+                return
+            batch, self.finished = self.finished, []
+        _export(batch)
+
+class Span:
+    """One timed operation; `set()` adds attributes."""
+
+    def __init__(self, name: str, trace: _Trace, parent_id, attributes):
+        self.name = name
+        self.trace = trace
+        self.trace_id = trace.trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.error = None
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_s = None
+        trace.started()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        self.duration_s = time.perf_counter() - self._t0
+        self.trace.ended(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_s * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": dict(self.attributes),
+        }
+
+class _NoopSpan:
+    trace_id = span_id = None
+
+    def set(self, **attributes):
+        pass
+
+_NOOP = _NoopSpan()
+
+@contextmanager
+def _activate(span: Span):
+    token = _CURRENT.set(span)
+    try:
+        yield span
+    except (asyncio.CancelledError, GeneratorExit):
+        span.status = "cancelled"
+        raise
+    except BaseException as e:
+        span.status = "error"
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end()
+        try:
+            _CURRENT.reset(token)
+        except ValueError:
+            pass  # async generator closed from another context
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Start a new trace with a root span (no-op when `TRACING` is off)."""
+    if not TRACING:
+        yield _NOOP
+        return
+    with _activate(Span(name, _Trace(secrets.token_hex(16)), None, attributes)) as root:
+        yield root
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the current span; a no-op outside a trace."""
+    parent = _CURRENT.get()
+    if parent is None:
+        yield _NOOP
+        return
+    with _activate(Span(name, parent.trace, parent.span_id, attributes)) as child:
+        yield child
+
+def current_span():
+    """The active span (a no-op span outside a trace)."""
+    return _CURRENT.get() or _NOOP
+
+def bind(fn):
+    """Wrap `fn` to run in a copy of the caller's context (for thread pools)."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+# ------------------------------------
+# Exporters
+# ------------------------------------
+def _pool(name):
+    global _FILE_POOL, _OTLP_POOL
+    with _POOL_LOCK:
+        if name == "file":
+            if _FILE_POOL is None:
+                _FILE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-file")
+            return _FILE_POOL
+        if _OTLP_POOL is None:
+            _OTLP_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="otlp")
+        return _OTLP_POOL
+
+def _export(spans):
+    # Snapshot on the caller's thread; serializing and I/O happen on the exporters'
+    records = [s.to_dict() for s in spans]
+    if TRACE_FILE:
+        _pool("file").submit(_write_jsonl, records)
+    if TRACE_OTLP_ENDPOINT:
+        _pool("otlp").submit(_post_otlp, records)
+
+def _write_jsonl(records):
+    lines = "".join(json.dumps(r, default=str) + "\n" for r in records)
+    try:
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(lines)
+    except OSError as e:
+        print(f"[warn] Could not write traces to {TRACE_FILE}: {e}")
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_span(s):
+    start_ns = int(s["start"] * 1e9)
+    span = {
+        "traceId": s["trace_id"],
+        "spanId": s["span_id"],
+        "name": s["name"],
+        "kind": 1,  # internal
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int(s["duration_ms"] * 1e6)),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s["attributes"].items() if v is not None],
+        "status": {"code": 2, "message": s["error"] or s["status"]} if s["status"] != "ok" else {"code": 1},
+    }
+    if s["parent_id"]:
+        span["parentSpanId"] = s["parent_id"]
+    return span
+
+def _post_otlp(spans):
+    import requests
+    body = {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "rag"}, "spans": [_otlp_span(s) for s in spans]}],
+        }]
+    }
+    try:
+        requests.post(TRACE_OTLP_ENDPOINT, json=body, timeout=5).raise_for_status()
+    except Exception as e:
+        print(f"[warn] OTLP export to {TRACE_OTLP_ENDPOINT} failed: {e}")